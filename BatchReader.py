@@ -0,0 +1,181 @@
+"""Offline re-reading of archived camera frames.
+
+Applies the rotation, digMasks cropping and digit model of a MeterToolConf.json
+to a directory of frames or a video file. The frames are split into chunks that
+a process pool classifies, each worker with its own interpreter. Readings are
+streamed to a CSV file as chunks finish, rerunning the same command resumes an
+interrupted job.
+
+    python BatchReader.py MeterToolConf.json SOURCE [--out readings.csv] [--workers N] [--chunk 64]
+"""
+import argparse
+import codecs
+import csv
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from InferenceBackend import loadInterpreter
+from DigitClassifier import DigitClassifier
+from DigitCropper import DigitCropper
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# Per process state of the pool workers, set up once by initWorker
+_worker = {}
+
+
+def initWorker(meterConf):
+    # One interpreter per process, parallelism comes from the pool only
+    cv2.setNumThreads(1)
+
+    readerDesc = meterConf["meterReaderDesc"]
+    interpreter = loadInterpreter(readerDesc.get("modelPath", "DigitNumberModel.tflite"),
+                                  readerDesc.get("inferenceBackend", "auto"), numThreads=1)
+
+    _worker["conf"] = meterConf
+    _worker["classifier"] = DigitClassifier(interpreter, len(meterConf["imgMaskDesc"]["digMasks"]),
+                                            readerDesc.get("cnnCacheSize", 256),
+                                            readerDesc.get("cnnCacheQuantBits", 2))
+    _worker["cropper"] = DigitCropper()
+
+
+def readChunk(task):
+    """Classify one chunk, returns a list of (frame, source, timestamp, value, valid, digits, probs)"""
+    kind, items = task
+    conf = _worker["conf"]
+    digMasks = conf["imgMaskDesc"]["digMasks"]
+    readerDesc = conf["meterReaderDesc"]
+
+    frames = []
+    for idx, source, timestamp, frame in iterFrames(kind, items):
+        if frame is not None:
+            frames.append((idx, source, timestamp, frame))
+
+    if not frames or not digMasks:
+        return []
+
+    crops = np.concatenate([_worker["cropper"].crop(frame, readerDesc["imgRot"], digMasks) for *_, frame in frames])
+    outputData = _worker["classifier"].predict(crops).reshape(len(frames), len(digMasks), -1)
+
+    rows = []
+    for (idx, source, timestamp, _), frameOut in zip(frames, outputData):
+        digits = np.argmax(frameOut, axis=1)
+        probs = frameOut[np.arange(len(digits)), digits]
+        value = round(sum(int(dig)*pow(10, int(powa)) for dig, powa in zip(digits, digMasks.keys())), 3)
+        valid = bool(np.all(probs >= readerDesc["minInferenceProb"]))
+        rows.append((idx, source, timestamp, value, valid, digits.tolist(), probs.tolist()))
+
+    return rows
+
+
+def iterFrames(kind, items):
+    if kind == "images":
+        for idx, path in items:
+            yield idx, os.path.basename(path), os.path.getmtime(path), cv2.imread(path)
+        return
+
+    # A video chunk is (path, start time, fps, frame indices), the worker decodes it itself
+    path, videoStart, fps, indices = items
+    video = cv2.VideoCapture(path)
+    video.set(cv2.CAP_PROP_POS_FRAMES, indices[0])
+    pos = indices[0]
+    try:
+        for idx in indices:
+            # Frames of the chunk that are already done are decoded but skipped
+            while pos <= idx:
+                check, frame = video.read()
+                pos += 1
+                if not check:
+                    return
+            yield idx, os.path.basename(path), videoStart + idx/fps, frame
+    finally:
+        video.release()
+
+
+def buildTasks(source, done, chunk, videoStart):
+    if os.path.isdir(source):
+        names = sorted(n for n in os.listdir(source) if n.lower().endswith(IMAGE_EXTS))
+        # Images are matched by file name, new files may shift the indices of a resumed job
+        todo = [(idx, os.path.join(source, n)) for idx, n in enumerate(names) if n not in done]
+        return [("images", todo[i:i+chunk]) for i in range(0, len(todo), chunk)], len(names)
+
+    video = cv2.VideoCapture(source)
+    if not video.isOpened():
+        raise SystemExit(f"Cannot open {source}")
+    total = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = video.get(cv2.CAP_PROP_FPS) or 1.0
+    video.release()
+
+    tasks = []
+    for start in range(0, total, chunk):
+        indices = [idx for idx in range(start, min(start+chunk, total)) if idx not in done]
+        if indices:
+            tasks.append(("video", (source, videoStart, fps, indices)))
+    return tasks, total
+
+
+def loadDone(outPath, byName=False):
+    """Frame indices, or source file names with byName, already in the output.
+
+    A torn last line of an interrupted run is cut off.
+    """
+    if not os.path.exists(outPath):
+        return set()
+
+    with open(outPath, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+
+    with open(outPath, newline='') as f:
+        if byName:
+            return {row["source"] for row in csv.DictReader(f)}
+        return {int(row["frame"]) for row in csv.DictReader(f)}
+
+
+def header(digMasks):
+    powas = list(digMasks.keys())
+    return ["frame", "source", "timestamp", "value", "valid"] + [f"digit_{p}" for p in powas] + [f"prob_{p}" for p in powas]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("conf", help="MeterToolConf.json with the masks and rotation of the meter")
+    parser.add_argument("source", help="directory of frames or a video file")
+    parser.add_argument("--out", default="readings.csv", help="CSV file, an existing one is resumed")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk", type=int, default=64, help="frames per task, classified in one batch")
+    parser.add_argument("--video-start", type=float, default=0.0, help="unix time of the first video frame")
+    args = parser.parse_args()
+
+    with codecs.open(args.conf, 'r', 'utf-8') as jsf:
+        meterConf = json.load(jsf)
+
+    done = loadDone(args.out, os.path.isdir(args.source))
+    tasks, total = buildTasks(args.source, done, args.chunk, args.video_start)
+    print(f"{total} frames, {len(done)} already read, {len(tasks)} chunks on {args.workers} workers")
+
+    start = time.monotonic()
+    cnt = 0
+    newFile = not os.path.exists(args.out)
+    with open(args.out, 'a', newline='') as f, \
+            multiprocessing.Pool(args.workers, initializer=initWorker, initargs=(meterConf,)) as pool:
+        writer = csv.writer(f)
+        if newFile:
+            writer.writerow(header(meterConf["imgMaskDesc"]["digMasks"]))
+
+        # Chunks are written in completion order, the frame column keeps the order
+        for rows in pool.imap_unordered(readChunk, tasks):
+            for idx, source, timestamp, value, valid, digits, probs in rows:
+                writer.writerow([idx, source, f"{timestamp:.3f}", value, int(valid), *digits, *(f"{p:.4f}" for p in probs)])
+            f.flush()
+            cnt += len(rows)
+
+    elapsed = time.monotonic() - start
+    print(f"{cnt} frames read in {elapsed:.1f} s ({cnt / elapsed if elapsed else 0:.1f} frames/s)")
@@ -0,0 +1,103 @@
+import threading
+import time
+import cv2
+
+
+class CameraGrabber():
+    """Long-lived capture source running in a background thread.
+
+    Only the latest decoded frame is kept, so readers never pay the stream
+    connect cost and never get a stale, buffered frame.
+    """
+    def __init__(self, camUrl, name="") -> None:
+
+        self.camUrl = camUrl
+        self.name = name
+
+        # latest frame slot, guarded by the condition
+        self._frame = None
+        self._frameTime = 0.0
+        self._frameCond = threading.Condition()
+
+        self.reconnectCount = 0
+
+        # reconnect/backoff state
+        self._reconnect_delay = 1.0
+        self._max_reconnect_delay = 60.0
+
+        self._stopEvent = threading.Event()
+        self._thread = threading.Thread(target=self._grabLoop, name=f"camera_grabber_{name}", daemon=True)
+        self._thread.start()
+
+    def _backoff(self):
+        self._stopEvent.wait(self._reconnect_delay)
+        self._reconnect_delay = min(self._reconnect_delay * 2, self._max_reconnect_delay)
+
+    def _grabLoop(self):
+        video = None
+
+        while not self._stopEvent.is_set():
+            if video is None:
+                video = cv2.VideoCapture(self.camUrl)
+                if not video.isOpened():
+                    video.release()
+                    video = None
+                    print(f"Could not open camera {self.camUrl}, retrying in {self._reconnect_delay}s")
+                    self._backoff()
+                    continue
+                # keep the driver side queue as short as possible
+                video.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+            try:
+                check, frame = video.read()
+            except cv2.error:
+                check, frame = False, None
+
+            if not check or frame is None:
+                video.release()
+                video = None
+                self.reconnectCount += 1
+                print(f"Camera stream {self.camUrl} lost, reconnecting in {self._reconnect_delay}s")
+                self._backoff()
+                continue
+
+            self._reconnect_delay = 1.0
+
+            with self._frameCond:
+                self._frame = frame
+                self._frameTime = time.monotonic()
+                self._frameCond.notify_all()
+
+        if video is not None:
+            video.release()
+
+    def getFrame(self, newerThan=None, timeout=5.0):
+        """Return the latest frame and its age in seconds, or (None, None) on timeout.
+
+        If newerThan (a time.monotonic() timestamp) is given, only a frame grabbed after it is accepted.
+        """
+        deadline = time.monotonic() + timeout
+
+        with self._frameCond:
+            while self._frame is None or (newerThan is not None and self._frameTime <= newerThan):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, None
+                self._frameCond.wait(remaining)
+
+            return self._frame, time.monotonic() - self._frameTime
+
+    def hasFrame(self, newerThan=None):
+        """Non-blocking check whether getFrame(newerThan) would return at once"""
+        with self._frameCond:
+            return self._frame is not None and (newerThan is None or self._frameTime > newerThan)
+
+    def frameAge(self):
+        with self._frameCond:
+            if self._frame is None:
+                return None
+            return time.monotonic() - self._frameTime
+
+    def stop(self):
+        self._stopEvent.set()
+        self._thread.join(timeout=5)
@@ -0,0 +1,95 @@
+from collections import deque
+
+import numpy as np
+
+
+class CarryAwareDecoder():
+    """Decides which odometer wheels have to be classified in a round.
+
+    Wheels whose place value is at or below stepThresh or the largest
+    change of the last deltaRounds accepted readings can move by a full
+    revolution or more in one round, they are classified every round. Above
+    that a wheel can only move when the one below it rolls over from 9 to 0,
+    so it is classified only when the wheel below is classified and showed 9
+    in the last accepted reading, or when it turns out to have wrapped
+    around. Every fullRefreshRounds rounds, and after any rejected reading,
+    all wheels are classified.
+    """
+    def __init__(self, fullRefreshRounds=30, stepThresh=0.0, deltaRounds=8):
+
+        self.fullRefreshRounds = fullRefreshRounds
+        self.stepThresh = stepThresh
+
+        # changes of the accepted readings, in value units
+        self._deltas = deque(maxlen=deltaRounds)
+        self._value = None
+
+        # accepted classifier output per mask key
+        self._digits = {}
+        self._pending = None
+        self._rounds = fullRefreshRounds
+
+        self.saved = 0
+
+    def _digit(self, row):
+        return int(np.argmax(row))
+
+    def plan(self, keys):
+        """Per key the reused classifier output, or None if the wheel has to be classified"""
+        if self._rounds >= self.fullRefreshRounds or any(key not in self._digits for key in keys):
+            self._rounds = 0
+            return [None] * len(keys)
+        self._rounds += 1
+
+        # The carry rule only holds for wheels that move by less than a revolution per round
+        maxStep = max([self.stepThresh, *self._deltas])
+
+        plan = {}
+        lower = None
+        for key in sorted(keys, key=int):
+            if lower is None or pow(10, int(key)) <= maxStep or \
+                    (plan[lower] is None and self._digit(self._digits[lower]) == 9):
+                plan[key] = None
+            else:
+                plan[key] = self._digits[key]
+            lower = key
+
+        return [plan[key] for key in keys]
+
+    def missedCarries(self, keys, outputData, classified):
+        """Indices of skipped wheels whose lower neighbour wrapped around in this round"""
+        idx = {key: i for i, key in enumerate(keys)}
+        order = sorted(keys, key=int)
+
+        missed = []
+        for lower, key in zip(order[:-1], order[1:]):
+            lowIdx, keyIdx = idx[lower], idx[key]
+            if classified[lowIdx] and not classified[keyIdx] and lower in self._digits \
+                    and self._digit(outputData[lowIdx]) < self._digit(self._digits[lower]):
+                missed.append(keyIdx)
+        return missed
+
+    def setRound(self, keys, outputData, classified):
+        self._pending = dict(zip(keys, outputData))
+        self.saved += classified.count(False)
+
+    def commit(self):
+        if self._pending is not None:
+            self._digits.update(self._pending)
+
+            value = sum(self._digit(row) * pow(10, int(key)) for key, row in self._digits.items() if self._digit(row) < 10)
+            if self._value is not None:
+                self._deltas.append(abs(value - self._value))
+            self._value = value
+        self._pending = None
+
+    def discard(self):
+        # A skipped wheel may be the reason of the failure, so the next round reads all of them
+        self._pending = None
+        self._rounds = self.fullRefreshRounds
+
+    def reset(self):
+        self._digits = {}
+        self._deltas.clear()
+        self._value = None
+        self.discard()
@@ -0,0 +1,158 @@
+"""Fixed-size on-disk ring archive of the digit crops of every reading cycle.
+
+The crops live in a preallocated memory-mapped array (<path>.crops), the
+metadata of each slot in a small memory-mapped index (<path>.idx). Archiving a
+cycle is one copy into the next slot, disk use never grows. Exporting selected
+slots as training shards:
+
+    python CropArchive.py ARCHIVE --out shards [--below-prob 0.9] [--errors INF_LOW_PROB,PLAU_ERROR] [--shard-size 4096]
+"""
+import argparse
+import os
+
+import numpy as np
+
+
+class CropArchive():
+    """Ring buffer of digit crops with their classifier output, value and health state.
+
+    Every slot holds up to maxDigits crops of one cycle. The index record of a
+    slot is written after its crops and its sequence number last, so a slot
+    with seq 0 is empty or was being written when the process died. A
+    readOnly archive takes the slot count from the existing index file.
+    """
+    def __init__(self, path, slots=4096, maxDigits=8, cropShape=(32,20,3), readOnly=False):
+
+        self.path = path
+        self.slots = slots
+        self.maxDigits = maxDigits
+        self.cropShape = tuple(cropShape)
+
+        self.indexDtype = np.dtype([("seq", "<u8"), ("ts", "<f8"), ("value", "<f8"), ("health", "<u4"),
+                                    ("nDigits", "u1"), ("powas", "i1", (maxDigits,)),
+                                    ("digits", "i1", (maxDigits,)), ("probs", "<f4", (maxDigits,))])
+
+        if readOnly:
+            self.slots = slots = os.path.getsize(path + ".idx") // self.indexDtype.itemsize
+            self.crops = np.memmap(path + ".crops", dtype=np.uint8, mode="r", shape=(slots, maxDigits, *self.cropShape))
+            self.index = np.memmap(path + ".idx", dtype=self.indexDtype, mode="r", shape=(slots,))
+        else:
+            self.crops = self._open(path + ".crops", np.uint8, (slots, maxDigits, *self.cropShape))
+            self.index = self._open(path + ".idx", self.indexDtype, (slots,))
+
+        self.seq = int(self.index["seq"].max()) if slots else 0
+
+    @staticmethod
+    def _open(fileName, dtype, shape):
+        # A file of another size belongs to another layout, it is recreated
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        mode = "r+" if os.path.exists(fileName) and os.path.getsize(fileName) == size else "w+"
+        return np.memmap(fileName, dtype=dtype, mode=mode, shape=shape)
+
+    def append(self, crops, outputData, value, health, powas, ts):
+        """Store the crops of a cycle, outputData may be None if the classifier failed"""
+        n = min(len(crops), self.maxDigits)
+        slot = self.seq % self.slots
+        self.seq += 1
+
+        rec = self.index[slot]
+        rec["seq"] = 0
+        self.crops[slot, :n] = crops[:n]
+
+        rec["ts"] = ts
+        rec["value"] = value
+        rec["health"] = health
+        rec["nDigits"] = n
+        rec["powas"][:n] = [int(powa) for powa in powas[:n]]
+        if outputData is None:
+            rec["digits"][:n] = -1
+            rec["probs"][:n] = 0
+        else:
+            rows = np.asarray(outputData[:n])
+            rec["digits"][:n] = np.argmax(rows, axis=1)
+            rec["probs"][:n] = np.max(rows, axis=1)
+        rec["seq"] = self.seq
+
+    def select(self, healthMask=0, belowProb=None):
+        """Filled slots in archive order, optionally only those with one of the health bits or a digit below belowProb"""
+        filled = np.nonzero(self.index["seq"])[0]
+        slots = filled[np.argsort(self.index["seq"][filled])]
+
+        if healthMask or belowProb is not None:
+            index = self.index[slots]
+            keep = np.zeros(len(slots), dtype=bool)
+            if healthMask:
+                keep |= (index["health"] & healthMask) != 0
+            if belowProb is not None:
+                digitMask = np.arange(self.maxDigits) < index["nDigits"][:, None]
+                keep |= np.any((index["probs"] < belowProb) & digitMask, axis=1)
+            slots = slots[keep]
+
+        return slots
+
+    def read(self, slot):
+        """Index record and crops of a slot"""
+        rec = self.index[slot].copy()
+        return rec, np.array(self.crops[slot, :rec["nDigits"]])
+
+    def flush(self):
+        if self.index.mode == "r":
+            return
+        self.crops.flush()
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        del self.crops, self.index
+
+
+def exportShards(archive, slots, outDir, shardSize=4096):
+    """Write the digit crops of the slots as .npz shards, one sample per digit, returns the shard paths"""
+    os.makedirs(outDir, exist_ok=True)
+    paths = []
+    samples = {"crops": [], "digits": [], "probs": [], "powas": [], "seq": [], "ts": [], "value": [], "health": []}
+
+    def writeShard():
+        path = os.path.join(outDir, f"shard_{len(paths):05d}.npz")
+        np.savez_compressed(path, **{k: np.array(v) for k, v in samples.items()})
+        paths.append(path)
+        for v in samples.values():
+            v.clear()
+
+    for slot in slots:
+        rec, crops = archive.read(slot)
+        for i in range(rec["nDigits"]):
+            samples["crops"].append(crops[i])
+            samples["digits"].append(rec["digits"][i])
+            samples["probs"].append(rec["probs"][i])
+            samples["powas"].append(rec["powas"][i])
+            for key in ("seq", "ts", "value", "health"):
+                samples[key].append(rec[key])
+            if len(samples["crops"]) >= shardSize:
+                writeShard()
+
+    if samples["crops"]:
+        writeShard()
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archive", help="archive path without the .crops / .idx extension")
+    parser.add_argument("--out", default="shards", help="output directory of the .npz shards")
+    parser.add_argument("--max-digits", type=int, default=8, help="cropArchiveMaxDigits of the reader")
+    parser.add_argument("--below-prob", type=float, help="slots with any digit probability below this")
+    parser.add_argument("--errors", default="", help="comma separated ReaderHealthState names, e.g. INF_LOW_PROB,PLAU_ERROR")
+    parser.add_argument("--shard-size", type=int, default=4096, help="digit samples per shard")
+    args = parser.parse_args()
+
+    healthMask = 0
+    if args.errors:
+        from MeterReader import ReaderHealthState
+        for name in args.errors.split(","):
+            healthMask |= ReaderHealthState[name.strip()].value
+
+    archive = CropArchive(args.archive, maxDigits=args.max_digits, readOnly=True)
+    slots = archive.select(healthMask, args.below_prob)
+    paths = exportShards(archive, slots, args.out, args.shard_size)
+    print(f"{len(slots)} of {len(archive.select())} slots exported to {len(paths)} shards in {args.out}")
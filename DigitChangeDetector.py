@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+
+class DigitChangeDetector():
+    """Skips inference of digit crops that did not change since the last accepted reading.
+
+    Every mask keeps a small grayscale thumbnail of its last accepted crop
+    together with the classifier output for it. A new crop whose mean
+    absolute difference to that thumbnail stays within the tolerance (in gray
+    levels) reuses the stored output.
+    """
+    def __init__(self, tolerance, thumbSize=(10,16)):
+
+        self.tolerance = tolerance
+        self.thumbSize = thumbSize
+
+        self._refs = {}
+        self._pending = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def _thumb(self, crop):
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+        return cv2.resize(gray, self.thumbSize, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def lookup(self, key, crop):
+        """Return the stored classifier output if the crop is unchanged, otherwise None"""
+        thumb = self._thumb(crop)
+        ref = self._refs.get(key)
+
+        if ref is not None and np.mean(np.abs(thumb - ref[0])) <= self.tolerance:
+            self.hits += 1
+            return ref[1]
+
+        self.misses += 1
+        self._pending[key] = [thumb, None]
+        return None
+
+    def setResult(self, key, outputRow):
+        """Result of a crop that missed in lookup, it becomes the reference once the reading is accepted"""
+        if key in self._pending:
+            self._pending[key][1] = outputRow
+
+    def commit(self):
+        for key, (thumb, outputRow) in self._pending.items():
+            if outputRow is not None:
+                self._refs[key] = (thumb, outputRow)
+        self._pending = {}
+
+    def discard(self):
+        self._pending = {}
+
+    def reset(self):
+        self._refs = {}
+        self._pending = {}
+
+    def hitRate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,170 @@
+import hashlib
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def voteFrames(predData):
+    """Probability weighted vote over the frames of a burst.
+
+    predData holds frames x digits x classes probabilities. Every frame votes
+    for its top class with its probability, the output row of a digit is the
+    mean of the frames that voted for the winner. Returns the rows and the
+    lowest share of frames agreeing with the winner over the digits.
+
+    If the frames disagree on any digit, e.g. during a carry from ..09 to ..10,
+    per digit winners could make up a reading no frame showed. Whole frame
+    readings are voted on then, each weighted by its least confident digit,
+    and the share is that of the frames showing the winning reading.
+    """
+    if len(predData) == 1:
+        return predData[0], 1.0
+
+    votes = np.argmax(predData, axis=2)
+    weights = np.max(predData, axis=2)
+
+    if np.all(votes == votes[0]):
+        return predData.mean(axis=0), 1.0
+
+    readings, inverse = np.unique(votes, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    winner = np.argmax(np.bincount(inverse, weights=weights.min(axis=1), minlength=len(readings)))
+    agree = inverse == winner
+
+    return predData[agree].mean(axis=0), float(agree.mean())
+
+
+class ClassifierCache():
+    """Size-capped LRU of classifier outputs, keyed by a hash of the quantized crop.
+
+    The lowest quantBits bits of every pixel are dropped before hashing, so
+    repeated and near-identical crops map to the same entry.
+    """
+    def __init__(self, maxSize=256, quantBits=2):
+
+        self.maxSize = maxSize
+        self.quantBits = quantBits
+
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, crop):
+        quantized = np.right_shift(np.asarray(crop, dtype=np.uint8), self.quantBits)
+        return hashlib.blake2b(quantized.tobytes(), digest_size=16).digest()
+
+    def get(self, key):
+        row = self._entries.get(key)
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return row
+
+    def put(self, key, row):
+        self._entries[key] = row
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxSize:
+            self._entries.popitem(last=False)
+
+    def hitRate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class DigitClassifier():
+    """Batched wrapper around the TFLite digit interpreter.
+
+    The input tensor is sized to hold all digit crops of a meter, so a whole
+    reading is classified with a single invoke() call. Integer quantized
+    models are fed and read through the quantization parameters of their
+    input and output tensors, callers always see float probabilities. With a cacheSize the
+    results are memoized in a ClassifierCache, only unknown crops reach the
+    interpreter.
+    """
+    def __init__(self, cnnInterpreter, batchSize=1, cacheSize=0, cacheQuantBits=2):
+
+        self.cnnInterpreter = cnnInterpreter
+
+        # Get input and output tensors.
+        self.modelInputDict = self.cnnInterpreter.get_input_details()
+        self.modelOutputDict = self.cnnInterpreter.get_output_details()
+
+        self.inputShape = tuple(int(dim) for dim in self.modelInputDict[0]['shape'][1:])
+        self.inputDtype = self.modelInputDict[0]['dtype']
+        self.inputQuant = self._quantization(self.modelInputDict[0])
+        self.outputQuant = self._quantization(self.modelOutputDict[0])
+        self.batchSize = 0
+        self.batchBuff = None
+        self.lastInvokeTime = None
+
+        self.cache = ClassifierCache(cacheSize, cacheQuantBits) if cacheSize else None
+
+        self.resizeBatch(batchSize)
+
+    @staticmethod
+    def _quantization(details):
+        """(scale, zero point) of an integer tensor, None for float tensors"""
+        scale, zeroPoint = details.get('quantization', (0.0, 0))
+        if np.issubdtype(details['dtype'], np.integer) and scale:
+            return float(scale), int(zeroPoint)
+        return None
+
+    def resizeBatch(self, batchSize):
+        batchSize = max(1, int(batchSize))
+
+        self.cnnInterpreter.resize_tensor_input(self.modelInputDict[0]['index'], [batchSize, *self.inputShape])
+        self.cnnInterpreter.allocate_tensors()
+
+        self.batchSize = batchSize
+        self.batchBuff = np.zeros((batchSize, *self.inputShape), dtype=self.inputDtype)
+
+    def predict(self, crops):
+        """Classify a stack of 32x20x3 crops, returns one probability row per crop.
+
+        lastInvokeTime is the duration of the interpreter call, None if every crop came from the cache.
+        """
+        if self.cache is None:
+            return self._invoke(crops)
+
+        keys = [self.cache.key(crop) for crop in crops]
+        rows = [self.cache.get(key) for key in keys]
+        todo = [i for i, row in enumerate(rows) if row is None]
+
+        self.lastInvokeTime = None
+        if todo:
+            predData = self._invoke(np.asarray(crops)[todo])
+            for i, row in zip(todo, predData):
+                rows[i] = row
+                self.cache.put(keys[i], row)
+
+        return np.stack(rows)
+
+    def _invoke(self, crops):
+        cnt = len(crops)
+
+        # Invoke time grows with the batch, padding would waste it. Resizing
+        # is cheap, the tensors are only reallocated when the count changes.
+        if cnt != self.batchSize:
+            self.resizeBatch(cnt)
+
+        if self.inputQuant is None:
+            self.batchBuff[:] = crops
+        else:
+            scale, zeroPoint = self.inputQuant
+            info = np.iinfo(self.inputDtype)
+            self.batchBuff[:] = np.clip(np.round(np.asarray(crops, dtype=np.float32) / scale + zeroPoint), info.min, info.max)
+
+        self.cnnInterpreter.set_tensor(self.modelInputDict[0]['index'], self.batchBuff)
+
+        start = time.perf_counter()
+        self.cnnInterpreter.invoke()
+        self.lastInvokeTime = time.perf_counter() - start
+
+        outputData = self.cnnInterpreter.get_tensor(self.modelOutputDict[0]['index'])
+        if self.outputQuant is not None:
+            scale, zeroPoint = self.outputQuant
+            outputData = (outputData.astype(np.float32) - zeroPoint) * scale
+        return outputData
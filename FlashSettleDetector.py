@@ -0,0 +1,53 @@
+import numpy as np
+
+
+class FlashSettleDetector():
+    """Decides when the flash illumination of the digit masks has become stable.
+
+    update() is fed the digit crops of every new frame after flashOn. The
+    mean brightness and a coarse gray histogram of the crops are compared to
+    the previous frame, the light is settled once stableFrames consecutive
+    frames stay within tolerance (gray levels) and histTolerance (share of
+    pixels changing bins). With a baseline from before the flash, the
+    brightness must also have risen by minRise, unless riseFrames frames went
+    by without such a rise, e.g. in a lit room.
+    """
+    def __init__(self, tolerance=2.0, histTolerance=0.05, stableFrames=3, minRise=5.0, riseFrames=10):
+
+        self.tolerance = tolerance
+        self.histTolerance = histTolerance
+        self.stableFrames = stableFrames
+        self.minRise = minRise
+        self.riseFrames = riseFrames
+
+        self.reset()
+
+    @staticmethod
+    def _stats(crops):
+        gray = np.asarray(crops, dtype=np.uint16).sum(axis=-1) // 3 if np.ndim(crops) == 4 else np.asarray(crops, dtype=np.uint16)
+        hist = np.bincount((gray >> 4).ravel(), minlength=16) / max(gray.size, 1)
+        return float(gray.mean()), hist
+
+    def reset(self, baselineCrops=None):
+        """Start a new flash, baselineCrops are the crops of a frame taken before it"""
+        self.baseline = self._stats(baselineCrops)[0] if baselineCrops is not None and len(baselineCrops) else None
+        self.frames = 0
+        self.stable = 0
+        self._prev = None
+
+    def update(self, crops):
+        """Feed the crops of the next frame, returns True once the illumination is settled"""
+        mean, hist = self._stats(crops)
+        self.frames += 1
+
+        if self._prev is not None and abs(mean - self._prev[0]) <= self.tolerance \
+                and np.abs(hist - self._prev[1]).sum() / 2 <= self.histTolerance:
+            self.stable += 1
+        else:
+            self.stable = 0
+        self._prev = (mean, hist)
+
+        risen = self.baseline is None or mean - self.baseline >= self.minRise or self.frames >= self.riseFrames
+
+        # stableFrames unchanged frames means stableFrames + 1 frames compared
+        return risen and self.stable >= self.stableFrames
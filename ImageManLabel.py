@@ -1,20 +1,23 @@
-
-from copy import deepcopy
 import cv2
 
-from PyQt5.QtWidgets import QLabel
+from PyQt5.QtWidgets import QLabel, QStyle, QApplication
 
-from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import  Qt, QEvent
+from PyQt5.QtGui import QPixmap, QImage, QPainter, QPen, QColor, QFont, QFontMetrics
+from PyQt5.QtCore import  Qt, QEvent, QTimer, QRect, QPoint
 from types import NoneType
 
 class ImageManLabel(QLabel):
+    """Shows a frame with the digit mask rectangles on top of it.
+
+    The frame is converted to a pixmap once in setImage. Rectangles and their
+    labels are an overlay painted in paintEvent, so dragging a mask repaints
+    only the area around it instead of copying and converting the frame.
+    Mouse moves are coalesced to the display refresh rate.
+    """
     def __init__(self, onRectCb=None):
         super().__init__()
         if type(onRectCb) != NoneType:
             self.installEventFilter(self)
-        self.currImage = None
-        self.savedImage = None
         self.origImage = None
         self.onRectCb = onRectCb
         
@@ -22,6 +25,24 @@ class ImageManLabel(QLabel):
         self.recBotRight = (0,0)
         
         self.inhibitDraw = False
+
+        # Overlay items are (tl, br, text), saveImage keeps the current ones
+        self.currRects = []
+        self.savedRects = []
+
+        self.overlayPen = QPen(QColor(0,255,0), 2)
+        self.overlayFont = QFont()
+        self.overlayFont.setPixelSize(22)
+        self.overlayFont.setBold(True)
+        self.overlayFont.setItalic(True)
+        self.overlayMetrics = QFontMetrics(self.overlayFont)
+
+        screen = QApplication.primaryScreen()
+        refreshRate = screen.refreshRate() if screen is not None and screen.refreshRate() > 0 else 60
+        self.moveTimer = QTimer(self)
+        self.moveTimer.setSingleShot(True)
+        self.moveTimer.setInterval(int(1000 / refreshRate))
+        self.moveTimer.timeout.connect(self.drawDragRect)
     
     def convert_cv_qt(self, cv_img, keepOrigSize=True):
         """Convert from an opencv image to QPixmap"""
@@ -34,33 +55,77 @@ class ImageManLabel(QLabel):
         return QPixmap.fromImage(convert_to_Qt_format)
     
     
-    def setImage(self, frame=None):
+    def setImage(self, frame=None, keepRects=False):
         if type(frame) == NoneType:
-            frame = deepcopy(self.currImage)
-        else:
-            self.currImage = deepcopy(frame)
-            self.savedImage = deepcopy(frame)
-            self.origImage = deepcopy(frame)
-        qt_img = self.convert_cv_qt(frame)
-        self.setPixmap(qt_img)
+            self.update()
+            return
+        # A new frame starts without rectangles unless they are kept, it is converted only here
+        self.origImage = frame.copy()
+        if not keepRects:
+            self.currRects = []
+            self.savedRects = []
+        self.setPixmap(self.convert_cv_qt(frame))
     
     def drawRect(self, tl, br, putText=None):
-        self.currImage = deepcopy(self.savedImage)
-        cv2.rectangle(self.currImage,tl,br,(0,255,0),2)
-
-        if type(putText) != type(None):
-            self.currImage = cv2.putText(self.currImage, str(putText), (tl[0], br[1]), cv2.FONT_ITALIC, 1, (1,255,0), 2, cv2.LINE_AA)
+        item = (tuple(tl), tuple(br), None if type(putText) == NoneType else str(putText))
+        self.setRects(self.savedRects + [item])
 
-        self.setImage()
+    def drawDragRect(self):
+        self.drawRect(self.recTopLeft, self.recBotRight)
     
     def resetRect(self, tl, br):
 
         if tl[0]>0 and br[0]>0 and tl[1]>0 and br[1]>0:
-            self.currImage[tl[1]-2:br[1]+2, tl[0]-2:br[0]+2] = self.origImage[tl[1]-2:br[1]+2, tl[0]-2:br[0]+2]
-            self.setImage()
+            # Rectangles drawn inside the area are dropped, the frame under them was never touched
+            area = QRect(QPoint(tl[0]-2, tl[1]-2), QPoint(br[0]+2, br[1]+2))
+            self.setRects([item for item in self.currRects if not area.contains(self.itemRect(item))])
 
     def saveImage(self):
-        self.savedImage = deepcopy(self.currImage)
+        self.savedRects = list(self.currRects)
+
+    def setRects(self, rects):
+        # Only the changed rectangles are repainted
+        changed = [item for item in self.currRects if item not in rects] + [item for item in rects if item not in self.currRects]
+        self.currRects = rects
+
+        dirty = QRect()
+        for item in changed:
+            dirty = dirty.united(self.itemBounds(item))
+        if not dirty.isNull():
+            self.update(dirty.translated(self.imageOffset()))
+
+    def itemRect(self, item):
+        tl, br, _ = item
+        return QRect(QPoint(*tl), QPoint(*br)).normalized()
+
+    def itemBounds(self, item):
+        bounds = self.itemRect(item).adjusted(-2, -2, 2, 2)
+        tl, br, text = item
+        if text is not None:
+            bounds = bounds.united(self.overlayMetrics.boundingRect(text).translated(tl[0], br[1]).adjusted(-2, -2, 2, 2))
+        return bounds
+
+    def imageOffset(self):
+        # Mouse positions are used as frame coordinates, the overlay is shifted like the pixmap
+        pixmap = self.pixmap()
+        if pixmap is None or pixmap.isNull():
+            return QPoint(0,0)
+        return QStyle.alignedRect(self.layoutDirection(), self.alignment(), pixmap.size(), self.contentsRect()).topLeft()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.currRects:
+            return
+
+        painter = QPainter(self)
+        painter.translate(self.imageOffset())
+        painter.setPen(self.overlayPen)
+        painter.setFont(self.overlayFont)
+        for item in self.currRects:
+            painter.drawRect(self.itemRect(item))
+            if item[2] is not None:
+                painter.drawText(QPoint(item[0][0], item[1][1]), item[2])
+        painter.end()
         
      
     def eventFilter(self, obj, event):
@@ -69,7 +134,9 @@ class ImageManLabel(QLabel):
                 x = event.x()
                 y = event.y()
                 self.recBotRight = (x,y)
-                self.drawRect(self.recTopLeft, self.recBotRight)
+                # The rectangle follows the latest position once per display refresh
+                if not self.moveTimer.isActive():
+                    self.moveTimer.start()
             elif event.type() == QEvent.MouseButtonPress:
                 x = event.x()
                 y = event.y()
@@ -79,6 +146,7 @@ class ImageManLabel(QLabel):
                 x = event.x()
                 y = event.y()
                 if event.button() == Qt.LeftButton:
+                    self.moveTimer.stop()
                     self.recBotRight = (x,y)
                     self.drawRect(self.recTopLeft, self.recBotRight)
                     
@@ -0,0 +1,56 @@
+import importlib
+
+# Interpreter providers in the order the "auto" backend tries them. The
+# lightweight loaders come first, full TensorFlow is only the last resort.
+BACKENDS = {
+    "tflite_runtime": ("tflite_runtime.interpreter", "Interpreter"),
+    "litert": ("ai_edge_litert.interpreter", "Interpreter"),
+    "tensorflow": ("tensorflow", "lite.Interpreter"),
+}
+
+_interpreterClasses = {}
+
+
+def _importBackend(name):
+    """Import a backend on first use, returns its Interpreter class or None if it is not installed"""
+    if name not in _interpreterClasses:
+        modName, attrPath = BACKENDS[name]
+        try:
+            obj = importlib.import_module(modName)
+            for attr in attrPath.split("."):
+                obj = getattr(obj, attr)
+        except (ImportError, AttributeError):
+            obj = None
+        _interpreterClasses[name] = obj
+
+    return _interpreterClasses[name]
+
+
+def _backendNames(backend):
+    return list(BACKENDS.keys()) if backend == "auto" else [backend]
+
+
+def getInterpreterClass(backend="auto"):
+    for name in _backendNames(backend):
+        interpClass = _importBackend(name)
+        if interpClass is not None:
+            return interpClass
+
+    raise ImportError(f"No TFLite interpreter available for backend '{backend}', install tflite-runtime, ai-edge-litert or tensorflow.")
+
+
+def loadInterpreter(modelPath="DigitNumberModel.tflite", backend="auto", numThreads=None):
+    lastError = None
+    kwargs = {"num_threads": numThreads} if numThreads else {}
+
+    for name in _backendNames(backend):
+        interpClass = _importBackend(name)
+        if interpClass is None:
+            continue
+        try:
+            return interpClass(model_path=modelPath, **kwargs)
+        except Exception as e:
+            # A broken install (e.g. built against another numpy) falls through to the next backend
+            lastError = e
+
+    raise ImportError(f"No usable TFLite interpreter for backend '{backend}', install tflite-runtime, ai-edge-litert or tensorflow.") from lastError
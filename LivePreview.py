@@ -0,0 +1,117 @@
+import threading
+import time
+
+import cv2
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from DigitCropper import DigitCropper
+
+
+class CaptureWorker(QThread):
+    """Streams the frames of a CameraGrabber to the GUI thread.
+
+    Waiting for frames and rotating them by imgRot happens in this thread.
+    A frame is only emitted after the GUI acknowledged the previous one with
+    ackFrame(), so a busy event loop drops frames instead of queueing them.
+    """
+    # raw frame for the crops, rotated frame for display
+    frameReady = pyqtSignal(object, object)
+    captureFailed = pyqtSignal(str)
+
+    def __init__(self, camera, angle, timeout=5.0, pollInterval=0.2):
+        super().__init__()
+        self.camera = camera
+        self.angle = angle
+        self.timeout = timeout
+        self.pollInterval = pollInterval
+
+        self._stopEvent = threading.Event()
+        self._acked = threading.Event()
+        self._acked.set()
+
+    def run(self):
+        frameTime = None
+        waitStart = time.monotonic()
+
+        while not self._stopEvent.is_set():
+            # Short waits, so stop() never hangs on a dead camera
+            frame, frameAge = self.camera.getFrame(newerThan=frameTime, timeout=self.pollInterval)
+            if frame is None:
+                if time.monotonic() - waitStart > self.timeout:
+                    self.captureFailed.emit("ERROR: no frame from the camera!")
+                    waitStart = time.monotonic()
+                continue
+
+            frameTime = time.monotonic() - frameAge
+            waitStart = time.monotonic()
+            if not self._acked.is_set():
+                continue
+            self._acked.clear()
+
+            h, w = frame.shape[:2]
+            rotM = cv2.getRotationMatrix2D(center=(w/2, h/2), angle=self.angle, scale=1)
+            self.frameReady.emit(frame, cv2.warpAffine(src=frame, M=rotM, dsize=(w, h)))
+
+    def ackFrame(self):
+        self._acked.set()
+
+    def stop(self):
+        self._stopEvent.set()
+        self.wait()
+
+
+class InferenceWorker(QThread):
+    """Classifies the digit masks of the newest submitted frame, at most fps times a second.
+
+    Only the newest frame is kept, a slow interpreter skips frames instead
+    of queueing them. All masks of a frame are classified in one batch by
+    the worker's own classifier, created in this thread by classifierFactory,
+    so the interpreter of the GUI thread is never shared.
+    """
+    # mask powers, crops and probability rows, in the same order
+    predictionsReady = pyqtSignal(object, object, object)
+
+    def __init__(self, classifierFactory, fps=2.0):
+        super().__init__()
+        self.classifierFactory = classifierFactory
+        self.interval = 1 / fps if fps > 0 else 0.0
+
+        self._cond = threading.Condition()
+        self._pending = None
+        self._stopped = False
+
+    def submit(self, frame, angle, digMasks):
+        with self._cond:
+            self._pending = (frame, angle, dict(digMasks))
+            self._cond.notify()
+
+    def run(self):
+        classifier = self.classifierFactory()
+        cropper = DigitCropper()
+        lastRun = 0.0
+
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or self._stopped)
+                # Frames submitted during the throttle delay replace the pending one
+                delay = lastRun + self.interval - time.monotonic()
+                if delay > 0:
+                    self._cond.wait_for(lambda: self._stopped, timeout=delay)
+                if self._stopped:
+                    break
+                frame, angle, digMasks = self._pending
+                self._pending = None
+
+            lastRun = time.monotonic()
+            if not digMasks:
+                continue
+
+            crops = cropper.crop(frame, angle, digMasks)
+            self.predictionsReady.emit(list(digMasks.keys()), crops, classifier.predict(crops))
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.wait()
@@ -1,7 +1,6 @@
 
 import sys
 import cv2
-import tensorflow as tf
 import numpy as np
 
 from paho.mqtt import client as mqtt_client
@@ -13,6 +12,11 @@ from copy import deepcopy
 from ImageManLabel import ImageManLabel
 from ImageMaskPicker import MaskDigitItem
 from MqttHandler import MqttHandler
+from CameraGrabber import CameraGrabber
+from DigitClassifier import DigitClassifier
+from InferenceBackend import loadInterpreter
+from DigitCropper import DigitCropper
+from LivePreview import CaptureWorker, InferenceWorker
 
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QMainWindow, QHBoxLayout, QPushButton, QWidget, QVBoxLayout, QApplication,  \
@@ -32,6 +36,10 @@ class MeterConfGUI(QMainWindow):
             raise BaseException("Cannot open configuration file!")
         
         self.currMaskItem = None
+        self.camera = None
+        self.cropper = DigitCropper()
+        self.captureWorker = None
+        self.inferenceWorker = None
         
         self.displyWidth = 640
         self.displayHeight = 480
@@ -47,7 +55,8 @@ class MeterConfGUI(QMainWindow):
         
         self._setUpCnn()
         
-        self.mqttClient = MqttHandler(self.meterConf["mqttDesc"],
+        # The configurator never queues messages, it must not share the outbox file of the reader
+        self.mqttClient = MqttHandler({**self.meterConf["mqttDesc"], "outbox": {"file": None}},
                                       "gas_meter_configurator",
                                       self.onMqttConnect,
                                       self.onMqttDisConnect)
@@ -106,6 +115,11 @@ class MeterConfGUI(QMainWindow):
         captureBut = QPushButton("Capture image")
         captureBut.clicked.connect(self.captureImage)
         captureBut.setStyleSheet("background-color : lightgrey")
+
+        self.liveBut = QPushButton("Live preview")
+        self.liveBut.setCheckable(True)
+        self.liveBut.setStyleSheet("background-color : lightgrey")
+        self.liveBut.clicked.connect(self.toggleLivePreview)
         
         self.flashLigthBut = QPushButton("Flashlight")
         self.flashLigthBut.setCheckable(True)
@@ -121,6 +135,7 @@ class MeterConfGUI(QMainWindow):
         self.flashBrightSli.sliderReleased.connect(self.handleFlashBrightSLi)
 
         controlLay.addWidget(captureBut)
+        controlLay.addWidget(self.liveBut)
         controlLay.addWidget(self.flashLigthBut)
         controlLay.addWidget(self.flashBrightSli)
         controlLay.addStretch()
@@ -213,23 +228,28 @@ class MeterConfGUI(QMainWindow):
             
     def captureImage(self):
         try:
-            self.video = cv2.VideoCapture(self.meterConf["cameraDesc"]["camUrl"])
-            check, frame = self.video.read()
-            self.video.release()
+            # The stream is opened at the first capture and kept alive afterwards
+            if self.camera is None:
+                self.camera = CameraGrabber(self.meterConf["cameraDesc"]["camUrl"], "gas_meter_configurator")
+            frame, frameAge = self.camera.getFrame(timeout=self.meterConf["cameraDesc"].get("frameTimeout", 5))
             
             h, w = frame.shape[:2] 
             
             rotM = cv2.getRotationMatrix2D(center=(w/2, h/2), 
                                                     angle=self.meterConf["meterReaderDesc"]["imgRot"], 
                                                     scale=1) 
+            rawFrame = frame
             frame = cv2.warpAffine( src=frame, M=rotM, dsize=(w, h))
             #frame = self.drawGrid(frame)
             self.imageLabel.setImage(frame)
 
+            # Same cached remap crops as used by the reader, taken from the raw frame
+            crops = self.cropper.crop(rawFrame, self.meterConf["meterReaderDesc"]["imgRot"],
+                                      self.meterConf["imgMaskDesc"]["digMasks"])
+
             for i, (powa, rect) in enumerate(self.meterConf["imgMaskDesc"]["digMasks"].items()):
 
-                maskImg = frame[rect[0][1]:rect[1][1], rect[0][0]:rect[1][0]]
-                maskImg = cv2.resize(maskImg, (20,32))
+                maskImg = crops[i]
 
                 self.maskItemDict[powa].setMaskImg(maskImg)
                 self.maskItemDict[powa].setMaskCoord(*rect)
@@ -245,6 +265,71 @@ class MeterConfGUI(QMainWindow):
         except:
             self.statBar.showMessage("ERROR: could not connect to camera!")
     
+    def toggleLivePreview(self):
+        if self.liveBut.isChecked():
+            self.startLivePreview()
+        else:
+            self.stopLivePreview()
+
+    def startLivePreview(self):
+        # Creating the grabber does not block, frames are waited for in the capture worker
+        if self.camera is None:
+            self.camera = CameraGrabber(self.meterConf["cameraDesc"]["camUrl"], "gas_meter_configurator")
+
+        self.captureWorker = CaptureWorker(self.camera, self.meterConf["meterReaderDesc"]["imgRot"],
+                                           self.meterConf["cameraDesc"].get("frameTimeout", 5))
+        self.captureWorker.frameReady.connect(self.onPreviewFrame)
+        self.captureWorker.captureFailed.connect(self.statBar.showMessage)
+
+        self.inferenceWorker = InferenceWorker(self._createClassifier, self.meterConf["meterReaderDesc"].get("previewFps", 2))
+        self.inferenceWorker.predictionsReady.connect(self.onPreviewPredictions)
+
+        self.inferenceWorker.start()
+        self.captureWorker.start()
+        self.liveBut.setStyleSheet("background-color : yellow")
+        self.statBar.showMessage("Live preview started", 5000)
+
+    def stopLivePreview(self):
+        for worker in (self.captureWorker, self.inferenceWorker):
+            if worker is not None:
+                worker.stop()
+        self.captureWorker = None
+        self.inferenceWorker = None
+        self.liveBut.setChecked(False)
+        self.liveBut.setStyleSheet("background-color : lightgrey")
+
+    def onPreviewFrame(self, rawFrame, frame):
+        if self.captureWorker is None:
+            return
+
+        if self.imageLabel.origImage is None:
+            # First frame without a captured image, the configured masks are drawn once
+            self.imageLabel.setImage(frame)
+            for powa, rect in self.meterConf["imgMaskDesc"]["digMasks"].items():
+                self.maskItemDict[powa].setMaskCoord(*rect)
+                self.maskItemDict[powa].setItemIsSet()
+                self.maskItemDict[powa].dislightItem()
+                self.imageLabel.drawRect(*rect, powa)
+                self.imageLabel.saveImage()
+        else:
+            # The mask rectangles stay, only the frame under them is replaced
+            self.imageLabel.setImage(frame, keepRects=True)
+        self.captureWorker.ackFrame()
+
+        # The mask being changed is left alone
+        digMasks = {powa: rect for powa, rect in self.meterConf["imgMaskDesc"]["digMasks"].items() if powa != self.currMaskItem}
+        self.inferenceWorker.submit(rawFrame, self.meterConf["meterReaderDesc"]["imgRot"], digMasks)
+
+    def onPreviewPredictions(self, powers, crops, predData):
+        if self.inferenceWorker is None:
+            return
+
+        for powa, crop, outputRow in zip(powers, crops, predData):
+            if powa == self.currMaskItem or powa not in self.maskItemDict:
+                continue
+            self.maskItemDict[powa].setMaskImg(crop)
+            self.maskItemDict[powa].setPredict(*self._formatPredict(outputRow))
+
     def drawGrid(self, inFrame):
         outFrame = deepcopy(inFrame)
         h, w = inFrame.shape[:2]
@@ -263,6 +348,13 @@ class MeterConfGUI(QMainWindow):
 
         return outFrame
     
+    def closeEvent(self, event):
+        self.stopLivePreview()
+        if self.camera is not None:
+            self.camera.stop()
+        self.mqttClient.stop()
+        super().closeEvent(event)
+
     def _createMenu(self):
         menu = self.menuBar()
         menu.setNativeMenuBar(False)
@@ -281,27 +373,32 @@ class MeterConfGUI(QMainWindow):
     
     def _setUpCnn(self):
         # Load TFLite model and allocate tensors.
-        self.cnnInterpreter = tf.lite.Interpreter(model_path="DigitNumberModel.tflite")
-        
-        # Get input and output tensors.
-        self.modelInputDict = self.cnnInterpreter.get_input_details()
-        self.modelOutputDict = self.cnnInterpreter.get_output_details()
-        
-        self.cnnInterpreter.allocate_tensors()
+        self.cnnInterpreter = loadInterpreter(self.meterConf["meterReaderDesc"].get("modelPath", "DigitNumberModel.tflite"),
+                                              self.meterConf["meterReaderDesc"].get("inferenceBackend", "auto"))
+        
+        # Re-predicting the same masks (captures, dragging a mask) is served from the result cache
+        self.classifier = DigitClassifier(self.cnnInterpreter, 1,
+                                          self.meterConf["meterReaderDesc"].get("cnnCacheSize", 256),
+                                          self.meterConf["meterReaderDesc"].get("cnnCacheQuantBits", 2))
+
+    def _createClassifier(self):
+        # Called in the preview inference thread, which gets an interpreter of its own
+        return DigitClassifier(loadInterpreter(self.meterConf["meterReaderDesc"].get("modelPath", "DigitNumberModel.tflite"),
+                                               self.meterConf["meterReaderDesc"].get("inferenceBackend", "auto")),
+                               len(self.meterConf["imgMaskDesc"]["digMasks"]),
+                               self.meterConf["meterReaderDesc"].get("cnnCacheSize", 256),
+                               self.meterConf["meterReaderDesc"].get("cnnCacheQuantBits", 2))
 
     def _cnnPredict(self,img):
-        img = img.astype(np.float32)
-        
-        self.cnnInterpreter.set_tensor(self.modelInputDict[0]['index'], [img])
+        output_data = self.classifier.predict([img])
 
-        self.cnnInterpreter.invoke()
+        return self._formatPredict(output_data[0])
 
-        output_data = self.cnnInterpreter.get_tensor(self.modelOutputDict[0]['index'])
-        
-        res = np.argmax(output_data)
+    def _formatPredict(self, outputRow):
+        res = np.argmax(outputRow)
         
         resNum = "NaN" if res==10 else str(res)
-        perc = round(100*output_data[0][res],2)
+        perc = round(100*outputRow[res],2)
 
         return resNum, perc
 
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import codecs
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from MeterReader import MeterReader, logger
+from MqttHandler import MqttHandler
+from InferenceBackend import loadInterpreter
+from DigitClassifier import DigitClassifier
+from CameraGrabber import CameraGrabber
+from ReaderMetrics import MetricsRegistry, MetricsServer
+
+
+class EngineMeterReader(MeterReader):
+    """MeterReader whose configuration, camera, MQTT connection and model are owned by a MeterEngine"""
+    def __init__(self, engine, name):
+        self.engine = engine
+        super().__init__(name, engine.confPath)
+
+    def loadConf(self):
+        self.meterConf = self.engine.buildMeterConf(self.name)
+
+    def setUpMetrics(self):
+        self.metrics = self.engine.metrics
+
+    def setUpCamera(self):
+        self.camera = self.engine.getCamera(self.meterConf["cameraDesc"]["camUrl"])
+
+    def setUpMqtt(self):
+        self.mqttClient = self.engine.mqttClient
+
+        # The shared connection may have been established before this meter existed
+        if self.mqttClient.client is not None and self.mqttClient.client.is_connected():
+            self.onMqttConnect(0)
+
+    def setUpCnn(self):
+        self.classifier = self.engine.classifier
+
+
+class MeterEngine():
+    """Reads many meters in one process.
+
+    The configuration lists the meters under "meters", each with its own
+    cameraDesc, meterReaderDesc, imgMaskDesc and mqttDesc topics, while the
+    broker settings in the top level mqttDesc are shared. All meters use one
+    loaded model and one MQTT connection. Rounds are split into a flash and a
+    capture phase which are ordered in a priority queue, so the flash wait of
+    one meter never blocks the others.
+    """
+    def __init__(self, confPath="MeterToolConf.json"):
+
+        self.confPath = confPath
+        self.framePollInterval = 0.05
+
+        with codecs.open(self.confPath, 'r', 'utf-8') as jsf:
+            self.rootConf = json.load(jsf)
+
+        self.meters = {}
+        # onMqttConnect runs on the MQTT network thread while meters are still built
+        self._metersLock = threading.Lock()
+        self.cameras = {}
+        self.metrics = MetricsRegistry()
+
+        # Scheduler queue of (due time, sequence, phase, args)
+        self._queue = []
+        self._seq = itertools.count()
+
+        self.mqttClient = MqttHandler(self.rootConf["mqttDesc"],
+                                "meter_engine",
+                                self.onMqttConnect,
+                                self.onMqttDisConnect)
+
+        # One model for all meters, the batch follows the number of crops of each call
+        self.cnnInterpreter = loadInterpreter(self.rootConf.get("modelPath", "DigitNumberModel.tflite"), self.rootConf.get("inferenceBackend", "auto"))
+        self.classifier = DigitClassifier(self.cnnInterpreter, 1,
+                                          self.rootConf.get("cnnCacheSize", 256),
+                                          self.rootConf.get("cnnCacheQuantBits", 2))
+
+        for name in self.rootConf["meters"].keys():
+            # A connect during the build is either seen by the meter's setUpMqtt or waits for the lock
+            with self._metersLock:
+                self.meters[name] = EngineMeterReader(self, name)
+            self.schedule(time.monotonic(), self._flashPhase, self.meters[name])
+
+    def buildMeterConf(self, name):
+        """Per meter configuration in the single meter layout, sharing the nested dicts of the root configuration"""
+        meterConf = dict(self.rootConf["meters"][name])
+        meterConf["mqttDesc"] = {**self.rootConf["mqttDesc"], **meterConf.get("mqttDesc", {})}
+        return meterConf
+
+    def getCamera(self, camUrl):
+        # Meters watched by the same camera share its stream
+        if camUrl not in self.cameras:
+            self.cameras[camUrl] = CameraGrabber(camUrl, f"engine_{len(self.cameras)}")
+        return self.cameras[camUrl]
+
+    def onMqttConnect(self, rc):
+        with self._metersLock:
+            meters = list(self.meters.values())
+        for meter in meters:
+            meter.onMqttConnect(rc)
+
+    def onMqttDisConnect(self):
+        print("Unexpected MQTT Broker disconnection! Trying to reconnect...")
+
+    def schedule(self, due, phase, *args):
+        heapq.heappush(self._queue, (due, next(self._seq), phase, args))
+
+    def _flashPhase(self, meter):
+        meter.checkErrStreak()
+        isSuccess = meter.startRound()
+
+        flashTime = meter.meterConf["meterReaderDesc"]["flashTime"]
+        if isSuccess and meter.watchesFlash():
+            meter.beginSettle()
+            self.schedule(time.monotonic() + self.framePollInterval, self._settlePhase, meter, time.monotonic() + flashTime)
+            return
+
+        flashSettled = time.monotonic() + flashTime
+        self.schedule(flashSettled, self._capturePhase, meter, isSuccess, flashSettled)
+
+    def _settlePhase(self, meter, deadline):
+        # Only frames already grabbed are checked, flashTime is the upper bound
+        settled = False
+        while not settled and meter.camera.hasFrame(meter.settleFrameTime):
+            settled = meter.pollSettle(0)
+
+        if not settled and time.monotonic() < deadline:
+            self.schedule(time.monotonic() + self.framePollInterval, self._settlePhase, meter, deadline)
+            return
+
+        self._capturePhase(meter, True, meter.endSettle(settled))
+
+    def _capturePhase(self, meter, isSuccess, flashSettled):
+        frame = None
+        if isSuccess:
+            # Poll instead of blocking, a slow camera must not hold up the other meters
+            deadline = flashSettled + meter.meterConf["cameraDesc"].get("frameTimeout", 5)
+            if not meter.camera.hasFrame(flashSettled) and time.monotonic() < deadline:
+                self.schedule(time.monotonic() + self.framePollInterval, self._capturePhase, meter, isSuccess, flashSettled)
+                return
+
+            frame = meter.captureFrame(flashSettled, 0)
+            isSuccess = frame is not None
+
+        meter.finishRound(isSuccess, frame)
+        self._scheduleNextRound(meter)
+
+    def _scheduleNextRound(self, meter):
+        self.schedule(time.monotonic() + meter.nextRoundDelay(), self._flashPhase, meter)
+
+    def run(self):
+        while self._queue:
+            due, _, phase, args = heapq.heappop(self._queue)
+
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                phase(*args)
+            except Exception:
+                # Keep the faulty meter in the schedule, the others are not affected
+                logger.exception(f"Round of {args[0].name} failed.")
+                self._scheduleNextRound(args[0])
+
+
+class AsyncMeterEngine(MeterEngine):
+    """MeterEngine variant driving every meter from its own asyncio task.
+
+    A round is split into awaitable stages: flash control, camera I/O and
+    MQTT publishing run in an I/O thread pool, inference runs in a single
+    worker executor as the shared interpreter is not thread safe. The flash
+    is switched off as soon as the frame is taken, in parallel to inference.
+    A slow camera or broker only stalls the stage of its own meter.
+    """
+    def run(self):
+        asyncio.run(self.runAsync())
+
+    async def runAsync(self):
+        self._cnnExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cnn")
+        self._ioExecutor = ThreadPoolExecutor(max_workers=max(4, 2*len(self.meters)), thread_name_prefix="meter_io")
+
+        try:
+            await asyncio.gather(*(self._meterLoop(meter) for meter in self.meters.values()))
+        finally:
+            self._cnnExecutor.shutdown(wait=False)
+            self._ioExecutor.shutdown(wait=False)
+
+    async def _meterLoop(self, meter):
+        while True:
+            try:
+                await self.readMeterAsync(meter)
+            except Exception:
+                logger.exception(f"Round of {meter.name} failed.")
+
+            await asyncio.sleep(meter.nextRoundDelay())
+
+    async def readMeterAsync(self, meter):
+        loop = asyncio.get_running_loop()
+
+        await loop.run_in_executor(self._ioExecutor, meter.checkErrStreak)
+        isSuccess = await loop.run_in_executor(self._ioExecutor, meter.startRound)
+
+        flashTime = meter.meterConf["meterReaderDesc"]["flashTime"]
+        if isSuccess and meter.watchesFlash():
+            deadline = time.monotonic() + flashTime
+            await loop.run_in_executor(self._ioExecutor, meter.beginSettle)
+            settled = False
+            while not settled and time.monotonic() < deadline:
+                settled = await loop.run_in_executor(self._ioExecutor, meter.pollSettle, deadline - time.monotonic())
+            flashSettled = meter.endSettle(settled)
+        else:
+            await asyncio.sleep(flashTime)
+            flashSettled = time.monotonic()
+
+        frame = None
+        if isSuccess:
+            frame = await loop.run_in_executor(self._ioExecutor, meter.captureFrame,
+                                               flashSettled, meter.meterConf["cameraDesc"].get("frameTimeout", 5))
+            isSuccess = frame is not None
+
+        # The lamp is not needed any more once the frame is taken, its health
+        # updates are serialized with the other stages by the reader's lock
+        flashOff = loop.run_in_executor(self._ioExecutor, meter.switchFlashOff)
+
+        sensor = await loop.run_in_executor(self._cnnExecutor, meter.inferValue, frame if isSuccess else None)
+        await loop.run_in_executor(self._ioExecutor, meter.evaluateValue, sensor)
+        await loop.run_in_executor(self._ioExecutor, meter.archiveRound, sensor)
+        await loop.run_in_executor(self._ioExecutor, meter.recordHistory)
+        await flashOff
+
+        await loop.run_in_executor(self._ioExecutor, meter.publishReport)
+
+
+#-------------------------------------------------------------------
+# Start of script
+#-------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read several meters in one process.")
+    parser.add_argument("conf", nargs="?", default="MeterToolConf.json", help="multi-meter configuration file")
+    parser.add_argument("--async", dest="useAsync", action="store_true", help="run the asyncio pipeline")
+    args = parser.parse_args()
+
+    engine = (AsyncMeterEngine if args.useAsync else MeterEngine)(args.conf)
+
+    metricsPort = engine.rootConf.get("metricsDesc", {}).get("httpPort")
+    if metricsPort:
+        metricsServer = MetricsServer(engine.metrics, metricsPort)
+    engine.run()
@@ -10,14 +10,26 @@ fh.setFormatter(formatter)
 logger.addHandler(fh)
 
 from enum import Enum
-import cv2
-import tensorflow as tf
 import numpy as np
 import json
 import codecs
+import threading
 import time
 
 from MqttHandler import MqttHandler
+from InferenceBackend import loadInterpreter
+from DigitClassifier import DigitClassifier, voteFrames
+from CameraGrabber import CameraGrabber
+from DigitCropper import DigitCropper
+from DigitChangeDetector import DigitChangeDetector
+from CarryAwareDecoder import CarryAwareDecoder
+from MeterStateStore import MeterStateStore
+from CropArchive import CropArchive
+from FlashSettleDetector import FlashSettleDetector
+from ReadScheduler import ReadScheduler
+from PlausibilityFilter import PlausibilityFilter
+from ReadingHistory import ReadingHistory
+from ReaderMetrics import MetricsRegistry, MetricsServer, timedStage
 
 class ReaderHealthState(Enum):
     OK = 0
@@ -33,27 +45,52 @@ class ReaderHealthState(Enum):
 
 
 class MeterReader():
-    def __init__(self):
+    def __init__(self, name="gas_meter_reader", confPath="MeterToolConf.json"):
         
         # Initalize class variables
+        self.name = name
+        self.confPath = confPath
         self.meterConf = {}
         self.readerHealth = ReaderHealthState.OK.value
+        # Stages of a round may run in parallel threads, see AsyncMeterEngine
+        self._healthLock = threading.Lock()
         self.errorStreak = 0
 
         self.delta = 0
         self.lastValue = 0
-
+        self.frameAge = None
+
+        self.camera = None
+        self.mqttClient = None
+        self.stateStore = None
+        self.cropArchive = None
+        self.history = None
+        self.classifier = None
+        self.cropper = DigitCropper()
+        self.roundStart = None
+        self.settleStart = None
+        self.settleFrameTime = None
+        self.roundCrops = None
+        self.roundOutput = None
+        self.voteAgreement = None
+        self.roundConfidence = 0.0
+
+        self.setUpMetrics()
         self.setUpMeter()
 
     def setError(self, errorType, msg=""):  
-        self.readerHealth |= errorType.value
+        with self._healthLock:
+            self.readerHealth |= errorType.value
+        self.metrics.inc("meter_reader_errors_total", meter=self.name, error=errorType.name)
         logger.warning(f"{str(errorType)} - {msg}")
 
     def delError(self, errorType):
         # First check if error was set before, because delError is called periodically, nit just at errors
-        if self.readerHealth & errorType.value:
+        with self._healthLock:
+            if not self.readerHealth & errorType.value:
+                return
             self.readerHealth &= ~errorType.value
-            logger.info(f"{str(errorType)} has been healed.")
+        logger.info(f"{str(errorType)} has been healed.")
 
 
     def checkError(self):
@@ -69,12 +106,26 @@ class MeterReader():
         if self.meterConf["meterReaderDesc"]["errStreakResetThresh"] < self.errorStreak:
             self.setUpMeter(isRestart=True)
             self.errorStreak = 0
-            self.readerHealth = ReaderHealthState.OK.value
+            with self._healthLock:
+                self.readerHealth = ReaderHealthState.OK.value
+
+    def nextRoundDelay(self):
+        """Seconds until the next round, following the consumption if meterReaderDesc.readSchedule is set"""
+        if self.readScheduler is None:
+            return self.meterConf["meterReaderDesc"]["timeBtwRounds"]
+
+        # A failed round leaves delta untouched, the health state tells it apart from an idle meter
+        delay = self.readScheduler.nextInterval(self.delta, self.checkError())
+        self.metrics.setGauge("meter_reader_next_read_seconds", delay, meter=self.name)
+        return delay
 
     def onMqttConnect(self, rc):
         if rc == 0:
             print("Connected to MQTT Broker!")
-            self.mqttClient.subscribeTotopic(self.meterConf["mqttDesc"]["topics"]["currValResp"], self.receiveValueFromHa)
+            self.mqttClient.subscribeTotopic(self.meterConf["mqttDesc"]["topics"]["currValResp"], self.receiveValueFromHa, decode="text")
+            historyReq = self.meterConf["mqttDesc"]["topics"].get("historyReq")
+            if historyReq:
+                self.mqttClient.subscribeTotopic(historyReq, self.answerHistoryRequest, decode="json")
             self.delError(ReaderHealthState.MQTT_ERROR)
         else:
             msg = f"Failed to connect, return code: {rc}.\n"
@@ -88,8 +139,60 @@ class MeterReader():
         if value is not None:
             print("Received gas value from Home Assisstant:", str(value), ". From type:", type(value))
 
+    def answerHistoryRequest(self, req):
+        """Answer a range query of the reading history on mqttDesc.topics.historyResp.
+
+        The request is a JSON object with optional start and end timestamps
+        (default the last day), resolution (0 raw, 60, 3600 or 86400) or
+        maxPoints, and an id that is echoed in the response.
+        """
+        if not isinstance(req, dict):
+            req = {}
+        resp = {"id": req.get("id")}
+
+        if self.history is None:
+            resp["error"] = "Reading history is not enabled, set meterReaderDesc.historyDir."
+        else:
+            try:
+                end = float(req.get("end", time.time()))
+                start = float(req.get("start", end - 86400))
+                resp.update(self.history.query(start, end, req.get("resolution"), req.get("maxPoints")))
+            except (TypeError, ValueError) as e:
+                resp["error"] = f"Invalid history request: {e}"
+
+        topic = self.meterConf["mqttDesc"]["topics"].get("historyResp")
+        if topic:
+            self.mqttClient.publish2opic(topic, json.dumps(resp))
+
     def readMeter(self):
+        isSuccess = self.startRound()
+
+        flashTime = self.meterConf["meterReaderDesc"]["flashTime"]
+        if isSuccess and self.watchesFlash():
+            # flashTime is only the upper bound, capture starts once the light is stable
+            deadline = time.monotonic() + flashTime
+            self.beginSettle()
+            settled = False
+            while not settled and time.monotonic() < deadline:
+                settled = self.pollSettle(deadline - time.monotonic())
+            flashSettled = self.endSettle(settled)
+        else:
+            time.sleep(flashTime)
+            flashSettled = time.monotonic()
+
+        frame = None
+        if isSuccess:
+            # Only a frame grabbed after the flash has settled is accepted
+            frame = self.captureFrame(flashSettled, self.meterConf["cameraDesc"].get("frameTimeout", 5))
+            isSuccess = frame is not None
+
+        self.finishRound(isSuccess, frame)
+
+    @timedStage("flash_on")
+    def startRound(self):
+        """Switch on the flash, returns False if the round cannot be read"""
         isSuccess = True # Variable to follow read success throughout a cycle
+        self.roundStart = time.perf_counter()
 
         topic = self.meterConf["mqttDesc"]["topics"]["flashOn"]
         msg = json.dumps({"bright":self.meterConf["meterReaderDesc"]["flashBright"]/100})
@@ -102,100 +205,303 @@ class MeterReader():
             isSuccess = False
         else:
             self.delError(ReaderHealthState.MQTT_ERROR)
-        
-        time.sleep(self.meterConf["meterReaderDesc"]["flashTime"])
 
-        if isSuccess:
-            try:
-                video = cv2.VideoCapture(self.meterConf["cameraDesc"]["camUrl"])
-                check, frame = video.read()
-                video.release()
-                h, w = frame.shape[:2] 
-                rotM = cv2.getRotationMatrix2D(center=(w/2, h/2), 
-                                                angle=self.meterConf["meterReaderDesc"]["imgRot"], 
-                                                scale=1) 
-                frame = cv2.warpAffine( src=frame, M=rotM, dsize=(w, h))
-
-
-                if type(frame) == type(None):
-                    self.setError(ReaderHealthState.VIDEO_ERROR, "empty frame")
-                else:
-                    self.delError(ReaderHealthState.VIDEO_ERROR)
-            except:
-                isSuccess = False
-                msg = "ERROR: could not connect to camera!"
-                print(msg)
-                self.setError(ReaderHealthState.VIDEO_ERROR, msg)
+        return isSuccess
+
+    def watchesFlash(self):
+        """True if the flash settling is detected from the frames instead of waiting the whole flashTime"""
+        return self.settleDetector is not None and bool(self.meterConf["imgMaskDesc"]["digMasks"])
+
+    def settleCrops(self, frame):
+        # Not timed as rotate_crop, the stage stays comparable with a fixed flashTime
+        return self.cropper.crop(frame, self.meterConf["meterReaderDesc"]["imgRot"], self.meterConf["imgMaskDesc"]["digMasks"])
+
+    def beginSettle(self):
+        """Start watching the illumination, the latest frame is still from before the flash"""
+        self.settleStart = time.monotonic()
+        self.settleFrameTime = self.settleStart
+
+        frame, _ = self.camera.getFrame(timeout=0)
+        self.settleDetector.reset(None if frame is None else self.settleCrops(frame))
+
+    def pollSettle(self, timeout=0):
+        """Feed the next new frame to the settle detector, returns True once the flash is settled"""
+        frame, _ = self.camera.getFrame(newerThan=self.settleFrameTime, timeout=max(timeout, 0))
+        if frame is None:
+            return False
+        self.settleFrameTime = time.monotonic()
+
+        return self.settleDetector.update(self.settleCrops(frame))
 
+    def endSettle(self, settled):
+        """Log how long settling took or that flashTime ran out, returns the time from which frames are accepted"""
+        flashSettled = time.monotonic()
+        settleTime = flashSettled - self.settleStart
+
+        # Timeouts are counted apart, they would pile up at flashTime in the histogram
+        if settled:
+            self.metrics.observe("meter_reader_flash_settle_seconds", settleTime, meter=self.name)
+            logger.info(f"Flash settled after {settleTime:.2f} s, {self.settleDetector.frames} frames.")
+        else:
+            self.metrics.inc("meter_reader_flash_settle_timeouts_total", meter=self.name)
+            logger.warning(f"Flash not settled within flashTime ({settleTime:.2f} s, {self.settleDetector.frames} frames), capturing anyway.")
+        return flashSettled
+
+    @timedStage("capture")
+    def captureFrame(self, newerThan, timeout):
+        """Take the first camera frame grabbed after newerThan, returns None on failure.
+
+        With meterReaderDesc.burstFrames above 1 the following frames are taken too and a list is returned.
+        """
+        frame = None
+        try:
+            frame, self.frameAge = self.camera.getFrame(newerThan=newerThan, timeout=timeout)
+
+            if type(frame) == type(None):
+                self.setError(ReaderHealthState.VIDEO_ERROR, "no fresh frame from camera")
+            else:
+                self.metrics.observe("meter_reader_frame_age_seconds", self.frameAge, meter=self.name)
+                self.delError(ReaderHealthState.VIDEO_ERROR)
+
+                burstFrames = self.meterConf["meterReaderDesc"].get("burstFrames", 1)
+                if burstFrames > 1:
+                    frame = self.captureBurst(frame, burstFrames)
+        except:
+            msg = "ERROR: could not connect to camera!"
+            print(msg)
+            self.setError(ReaderHealthState.VIDEO_ERROR, msg)
+
+        return frame
+
+    def captureBurst(self, frame, burstFrames):
+        """The given frame and up to burstFrames-1 frames grabbed after it, a slow camera gives a shorter burst"""
+        frames = [frame]
+        lastTime = time.monotonic()
+        while len(frames) < burstFrames:
+            frame, _ = self.camera.getFrame(newerThan=lastTime, timeout=self.meterConf["meterReaderDesc"].get("burstFrameTimeout", 0.5))
+            if frame is None:
+                break
+            frames.append(frame)
+            lastTime = time.monotonic()
+        return frames
+
+    def finishRound(self, isSuccess, frame):
+        """Evaluate the captured frame, publish the report and switch off the flash"""
+        sensor = self.inferValue(frame if isSuccess else None)
+        self.evaluateValue(sensor)
+        self.archiveRound(sensor)
+        self.recordHistory()
+        self.publishReport()
+        self.switchFlashOff()
+
+    def inferValue(self, frame):
+        """Read the meter value from the frame, returns None if there is nothing to evaluate"""
+        self.voteAgreement = None
         if not self.meterConf["imgMaskDesc"]["digMasks"]:
             self.setError(ReaderHealthState.SETTING_ERROR, "Image masks haven't been set")
-            isSuccess = False
+            return None
         else:
             self.delError(ReaderHealthState.SETTING_ERROR)
-            
 
-        if  isSuccess:
-            sensor = 0
-            for i, (powa, rect) in enumerate(self.meterConf["imgMaskDesc"]["digMasks"].items()):
+        if type(frame) == type(None):
+            return None
+
+        return self.decodeDigits(self.cropDigits(frame))
 
-                maskImg = frame[rect[0][1]:rect[1][1], rect[0][0]:rect[1][0]]
-                maskImg = cv2.resize(maskImg, (20,32))
-                maskImg = maskImg.astype(np.float32)
+    @timedStage("rotate_crop")
+    def cropDigits(self, frame):
+        """Digit crops of a frame or a burst of frames, as a frames x digits x 32 x 20 x 3 array"""
+        frames = frame if isinstance(frame, list) else [frame]
+        # Rotation, cropping and resizing are done by one cached remap on the raw frame
+        return np.stack([self.cropper.crop(frame, self.meterConf["meterReaderDesc"]["imgRot"], self.meterConf["imgMaskDesc"]["digMasks"])
+                         for frame in frames])
 
-                try:
-                    self.cnnInterpreter.set_tensor(self.modelInputDict[0]['index'], [maskImg])
+    @timedStage("inference")
+    def decodeDigits(self, crops):
+        sensor = 0
+        digMasks = self.meterConf["imgMaskDesc"]["digMasks"]
 
-                    self.cnnInterpreter.invoke()
+        # The first frame of a burst stands for the round in the crop archive
+        self.roundCrops = crops[0]
+        self.roundConfidence = 0.0
+        try:
+            outputData = self.classifyCrops(crops)
+            self.roundOutput = outputData
+            self.delError(ReaderHealthState.CNN_ERROR)
+        except:
+            self.discardDigitCache()
+            self.setError(ReaderHealthState.CNN_ERROR, "Error with getting tensor!")
+            return self.lastValue
 
-                    output_data = self.cnnInterpreter.get_tensor(self.modelOutputDict[0]['index'])
-                    
-                    prob = np.max(output_data)
-                    if prob < self.meterConf["meterReaderDesc"]["minInferenceProb"]:
-                        self.setError(ReaderHealthState.INF_LOW_PROB, f"Low probability of digit detection: {prob}, digit: {i}.")
-                        sensor = self.lastValue
-                        break
-                    else:
-                        self.delError(ReaderHealthState.INF_LOW_PROB)
+        for i, powa in enumerate(digMasks.keys()):
 
-                    res = np.argmax(output_data)
-        
-                    sensor += res * pow(10,int(powa))
-                    sensor = round(sensor, 3)
-                    self.delError(ReaderHealthState.CNN_ERROR)
-                except:
-                    sensor = self.lastValue
-                    self.setError(ReaderHealthState.CNN_ERROR, "Error with getting tensor!")
-     
-            rangeTh = self.meterConf["meterReaderDesc"]["singleStepThresh"]
-
-            # Verify sensor value
-            if sensor < self.lastValue: 
-                msg = f"Sensor value must be decreasing. Value:({sensor}), using last stored instead: {self.lastValue}"
-                self.setError(ReaderHealthState.PLAU_ERROR, msg)
-                print(msg)
-            elif (self.lastValue+rangeTh) < sensor and not self.firstRound:
-                msg = f"Value read ({sensor}) is not plausible as change is larger than the limit: ({rangeTh}) , using last stored instead: {self.lastValue}"
-                self.setError(ReaderHealthState.PLAU_ERROR, msg)
-                print(msg)
+            prob = np.max(outputData[i])
+            if prob < self.meterConf["meterReaderDesc"]["minInferenceProb"]:
+                self.discardDigitCache()
+                self.setError(ReaderHealthState.INF_LOW_PROB, f"Low probability of digit detection: {prob}, digit: {i}.")
+                return self.lastValue
             else:
-                self.delError(ReaderHealthState.PLAU_ERROR)
-                self.delta = sensor - self.lastValue
-                self.lastValue = sensor
-                self.firstRound = False
-                self.meterConf["meterReaderDesc"]["initMeterVal"] = self.lastValue
-                try:
-                    with open("MeterToolConf.json", 'w') as f:
-                        json.dump(self.meterConf, f, indent=4)
-
-                except:
-                    self.setError(ReaderHealthState.CONF_SAVE_ERROR)
+                self.delError(ReaderHealthState.INF_LOW_PROB)
+
+            res = np.argmax(outputData[i])
+
+            sensor += res * pow(10,int(powa))
+            sensor = round(sensor, 3)
+
+        self.roundConfidence = float(min(np.max(row) for row in outputData)) if len(outputData) else 0.0
+        return sensor
+
+    def classifyCrops(self, crops):
+        """Classifier output row per crop, skipped or unchanged digits reuse earlier results"""
+        keys = list(self.meterConf["imgMaskDesc"]["digMasks"].keys())
+
+        if self.carryDecoder is None:
+            outputData = [None] * len(keys)
+        else:
+            outputData = self.carryDecoder.plan(keys)
+        classified = [row is None for row in outputData]
+
+        todo = [i for i, row in enumerate(outputData) if row is None]
+        while todo:
+            self.inferCrops(keys, crops, todo, outputData)
+
+            # A wheel that wrapped around carries into the skipped one above it
+            todo = self.carryDecoder.missedCarries(keys, outputData, classified) if self.carryDecoder is not None else []
+            for i in todo:
+                classified[i] = True
+
+        if self.carryDecoder is not None:
+            self.carryDecoder.setRound(keys, outputData, classified)
+            self.metrics.setGauge("meter_reader_carry_saved_inferences", self.carryDecoder.saved, meter=self.name)
+
+        return outputData
+
+    def inferCrops(self, keys, crops, todo, outputData):
+        """Fill outputData at the todo indices, unchanged crops are served from the change detector"""
+        if self.changeDetector is not None:
+            changed = []
+            for i in todo:
+                outputData[i] = self.changeDetector.lookup(keys[i], crops[0][i])
+                if outputData[i] is None:
+                    changed.append(i)
+
+            self.metrics.inc("meter_reader_digit_cache_hits_total", len(todo) - len(changed), meter=self.name)
+            self.metrics.inc("meter_reader_digit_cache_misses_total", len(changed), meter=self.name)
+            self.metrics.setGauge("meter_reader_digit_cache_hit_rate", self.changeDetector.hitRate(), meter=self.name)
+            todo = changed
+
+        if not todo:
+            return
+
+        # The digits still to classify go to the interpreter in a single call, for every frame of a burst
+        burst = crops[:, todo]
+        predData = self.classifier.predict(burst.reshape(-1, *burst.shape[2:])).reshape(len(burst), len(todo), -1)
+        if self.classifier.lastInvokeTime is not None:
+            self.metrics.observe("meter_reader_invoke_seconds", self.classifier.lastInvokeTime, meter=self.name)
+
+        predData, agreement = voteFrames(predData)
+        if len(burst) > 1:
+            self.voteAgreement = agreement if self.voteAgreement is None else min(self.voteAgreement, agreement)
+            self.metrics.setGauge("meter_reader_vote_agreement", agreement, meter=self.name)
+
+        for i, row in zip(todo, predData):
+            outputData[i] = row
+            if self.changeDetector is not None:
+                self.changeDetector.setResult(keys[i], row)
+
+    def commitDigitCache(self):
+        for cache in (self.changeDetector, self.carryDecoder):
+            if cache is not None:
+                cache.commit()
+
+    def discardDigitCache(self):
+        for cache in (self.changeDetector, self.carryDecoder):
+            if cache is not None:
+                cache.discard()
+
+    @timedStage("plausibility")
+    def evaluateValue(self, sensor):
+        """Plausibility check of the read value, accepted values are stored"""
+        if sensor is None:
+            self.discardDigitCache()
+            return
+
+        rangeTh = self.meterConf["meterReaderDesc"]["singleStepThresh"]
+        msg = ""
+        recoveryMsg = ""
+
+        # Verify sensor value
+        if self.plausibility is not None:
+            if self.firstRound and sensor >= self.lastValue:
+                self.plausibility.reset(time.time(), sensor, self.roundConfidence)
+            else:
+                # A reading that failed to decode repeats lastValue with zero confidence, it does not move the flow estimate
+                isPlausible, resMsg = self.plausibility.check(time.time(), sensor, self.roundConfidence)
+                if isPlausible:
+                    recoveryMsg = resMsg
+                else:
+                    msg = f"{resMsg}, using last stored instead: {self.lastValue}"
+        elif sensor < self.lastValue: 
+            msg = f"Sensor value must be decreasing. Value:({sensor}), using last stored instead: {self.lastValue}"
+        elif (self.lastValue+rangeTh) < sensor and not self.firstRound:
+            msg = f"Value read ({sensor}) is not plausible as change is larger than the limit: ({rangeTh}) , using last stored instead: {self.lastValue}"
+
+        if msg:
+            self.setError(ReaderHealthState.PLAU_ERROR, msg)
+            self.discardDigitCache()
+            print(msg)
+        else:
+            if recoveryMsg:
+                logger.warning(recoveryMsg)
+            self.delError(ReaderHealthState.PLAU_ERROR)
+            # Crops of an accepted reading become the references of the change detector
+            self.commitDigitCache()
+            self.delta = sensor - self.lastValue
+            self.lastValue = sensor
+            self.firstRound = False
+            try:
+                # The counter goes to the state journal, the config file is left untouched
+                with self.metrics.timer("meter_reader_stage_seconds", meter=self.name, stage="persistence"):
+                    self.stateStore.append(self.lastValue, self.delta, self.meterConf["meterReaderDesc"]["initMeterVal"])
+            except:
+                self.setError(ReaderHealthState.CONF_SAVE_ERROR)
 
+    @timedStage("archive")
+    def archiveRound(self, sensor):
+        """Keep the crops of the round with their classifier output and the resulting health state"""
+        crops, outputData = self.roundCrops, self.roundOutput
+        self.roundCrops = self.roundOutput = None
+
+        if self.cropArchive is None or crops is None:
+            return
+        try:
+            self.cropArchive.append(crops, outputData, self.lastValue if sensor is None else sensor, self.readerHealth,
+                                    list(self.meterConf["imgMaskDesc"]["digMasks"].keys()), time.time())
+        except Exception as e:
+            logger.warning(f"Could not archive the digit crops: {e}")
+
+    @timedStage("history")
+    def recordHistory(self):
+        """Append the value of the round with its health state to the reading history"""
+        if self.history is None:
+            return
+        try:
+            self.history.append(time.time(), self.lastValue, self.readerHealth)
+        except Exception as e:
+            logger.warning(f"Could not append to the reading history: {e}")
+
+    @timedStage("publish")
+    def publishReport(self):
         print("Gas usage: ", self.lastValue, "m3")
         print("Health state: ", self.readerHealth)
 
         topic = self.meterConf["mqttDesc"]["topics"]["meterReport"]
-        msg = json.dumps({"sensorValue":self.lastValue, "delta": self.delta, "sensorHealth": self.readerHealth})
-        resSucc, resMsg  = self.mqttClient.publish2opic(topic, msg)
+        report = {"sensorValue":self.lastValue, "delta": self.delta, "sensorHealth": self.readerHealth, "timestamp": round(time.time(), 3)}
+        if self.voteAgreement is not None:
+            report["voteAgreement"] = round(self.voteAgreement, 3)
+        msg = json.dumps(report)
+        # Reports go through the outbox, a broker outage delays them instead of losing them
+        resSucc, resMsg  = self.mqttClient.publishQueued(topic, msg)
         self.delError(ReaderHealthState.CONF_SAVE_ERROR)
         print(resMsg)
         if not resSucc:
@@ -203,6 +509,38 @@ class MeterReader():
         else:
             self.delError(ReaderHealthState.MQTT_ERROR)
 
+        self.publishDiagnostics()
+
+    def publishDiagnostics(self):
+        if self.roundStart is not None:
+            self.metrics.observe("meter_reader_cycle_seconds", time.perf_counter() - self.roundStart, meter=self.name)
+            self.roundStart = None
+
+        self.metrics.setGauge("meter_reader_health", self.readerHealth, meter=self.name)
+        self.metrics.setGauge("meter_reader_value", self.lastValue, meter=self.name)
+        self.metrics.setGauge("meter_reader_camera_reconnects", self.camera.reconnectCount, meter=self.name)
+        self.metrics.setGauge("meter_reader_mqtt_reconnects", self.mqttClient.reconnectCount, meter=self.name)
+        self.metrics.setGauge("meter_reader_mqtt_disconnects", self.mqttClient.disconnectCount, meter=self.name)
+
+        cnnCache = getattr(self.classifier, "cache", None)
+        if cnnCache is not None:
+            # The classifier may be shared by several meters, so its cache is not labelled per meter
+            self.metrics.setGauge("meter_reader_cnn_cache_hits", cnnCache.hits)
+            self.metrics.setGauge("meter_reader_cnn_cache_misses", cnnCache.misses)
+
+        outbox = getattr(self.mqttClient, "outbox", None)
+        if outbox is not None:
+            self.metrics.setGauge("meter_reader_outbox_depth", outbox.depth())
+            self.metrics.setGauge("meter_reader_outbox_dropped", outbox.dropped)
+            self.metrics.setGauge("meter_reader_outbox_sent", self.mqttClient.outboxSent)
+            self.metrics.setGauge("meter_reader_outbox_drain_rate", round(self.mqttClient.drainRate, 3))
+
+        topic = self.meterConf["mqttDesc"]["topics"].get("diagnostics")
+        if topic:
+            self.mqttClient.publish2opic(topic, json.dumps(self.metrics.snapshot(meter=self.name)))
+
+    @timedStage("flash_off")
+    def switchFlashOff(self):
         topic = self.meterConf["mqttDesc"]["topics"]["flashOff"]
         msg = json.dumps({"bright":"0%"})
         resSucc, resMsg  = self.mqttClient.publish2opic(topic, msg)
@@ -213,56 +551,156 @@ class MeterReader():
             self.delError(ReaderHealthState.MQTT_ERROR)
 
 
+    def loadConf(self):
+        with codecs.open(self.confPath, 'r', 'utf-8') as jsf:
+            self.meterConf = json.load(jsf)
+
+    def setUpState(self):
+        readerDesc = self.meterConf["meterReaderDesc"]
+
+        if self.stateStore is not None:
+            self.stateStore.close()
+        self.stateStore = MeterStateStore(readerDesc.get("stateFile", f"{self.name}.state"),
+                                          readerDesc.get("stateSyncEvery", 30),
+                                          readerDesc.get("stateSyncInterval", 300))
+
+        self.lastValue = readerDesc["initMeterVal"]
+        try:
+            state = self.stateStore.load()
+        except OSError:
+            state = None
+            logger.warning("Could not read the meter state journal, starting from initMeterVal.")
+
+        # A changed initMeterVal in the config means the counter was deliberately reset
+        if state is not None and state[3] == readerDesc["initMeterVal"]:
+            self.lastValue = state[1]
+            logger.info(f"Recovered last value {self.lastValue} from the state journal.")
+
+    def setUpArchive(self):
+        readerDesc = self.meterConf["meterReaderDesc"]
+
+        if self.cropArchive is not None:
+            self.cropArchive.close()
+            self.cropArchive = None
+
+        if readerDesc.get("cropArchiveFile"):
+            try:
+                self.cropArchive = CropArchive(readerDesc["cropArchiveFile"],
+                                               readerDesc.get("cropArchiveSlots", 4096),
+                                               readerDesc.get("cropArchiveMaxDigits", 8))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not open the crop archive: {e}")
+
+    def setUpHistory(self):
+        readerDesc = self.meterConf["meterReaderDesc"]
+
+        if self.history is not None:
+            self.history.flush()
+            self.history = None
+
+        if readerDesc.get("historyDir"):
+            try:
+                self.history = ReadingHistory(readerDesc["historyDir"], readerDesc.get("historySegmentRecords", 65536))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not open the reading history: {e}")
+
+    def setUpMetrics(self):
+        self.metrics = MetricsRegistry()
+
+    def setUpCamera(self):
+        # Persistent camera stream, the connect cost is paid once and not in every round
+        if self.camera is not None:
+            self.camera.stop()
+        self.camera = CameraGrabber(self.meterConf["cameraDesc"]["camUrl"], self.name)
+
+    def setUpMqtt(self):
+        # A restart must not leave the old connection, its threads and outbox behind
+        if self.mqttClient is not None:
+            self.mqttClient.stop()
+        self.mqttClient = MqttHandler(self.meterConf["mqttDesc"],
+                                self.name,
+                                self.onMqttConnect,
+                                self.onMqttDisConnect)
+
+    def setUpCnn(self):
+        # The interpreter module is imported here, on first use, not at startup
+        self.cnnInterpreter = loadInterpreter(self.meterConf["meterReaderDesc"].get("modelPath", "DigitNumberModel.tflite"),
+                                              self.meterConf["meterReaderDesc"].get("inferenceBackend", "auto"))
+
+        # Input tensor is resized once to hold every digit mask of the meter
+        self.classifier = DigitClassifier(self.cnnInterpreter, len(self.meterConf["imgMaskDesc"]["digMasks"]),
+                                          self.meterConf["meterReaderDesc"].get("cnnCacheSize", 256),
+                                          self.meterConf["meterReaderDesc"].get("cnnCacheQuantBits", 2))
+
     def setUpMeter(self, isRestart=False):
         
-        logger.info("----------------------Starting script----------------------")
+        logger.info(f"----------------------Starting {self.name}----------------------")
         if isRestart:
             logger.warning(f"Meter reader has been restarted after an error streak. Last health state was: {self.readerHealth}.")
             
         try:
-            with codecs.open("MeterToolConf.json", 'r', 'utf-8') as jsf:
-                self.meterConf = json.load(jsf)
+            self.loadConf()
         except:
             msg = "Could not open configuration file!"
             self.setError(ReaderHealthState.CONF_ERROR, msg)
             print(msg)
 
-        self.lastValue = self.meterConf["meterReaderDesc"]["initMeterVal"]
+        self.setUpState()
+        self.setUpArchive()
+        self.setUpHistory()
         self.firstRound = self.meterConf["meterReaderDesc"]["ignoreFirstRoundPlauErr"]
 
-        self.mqttClient = MqttHandler(self.meterConf["mqttDesc"],
-                                "gas_meter_reader",
-                                self.onMqttConnect,
-                                self.onMqttDisConnect)
+        changeTolerance = self.meterConf["meterReaderDesc"].get("changeTolerance")
+        self.changeDetector = DigitChangeDetector(changeTolerance) if changeTolerance else None
 
+        if self.meterConf["meterReaderDesc"].get("carryAwareDecoding", False):
+            self.carryDecoder = CarryAwareDecoder(self.meterConf["meterReaderDesc"].get("fullRefreshRounds", 30),
+                                                  self.meterConf["meterReaderDesc"]["singleStepThresh"])
+        else:
+            self.carryDecoder = None
+
+        plausibility = self.meterConf["meterReaderDesc"].get("plausibilityFilter")
+        if plausibility not in (None, False):
+            # Seeded with the recovered counter, so the first reading is checked against it
+            self.plausibility = PlausibilityFilter(self.meterConf["meterReaderDesc"]["singleStepThresh"],
+                                                   **(plausibility if isinstance(plausibility, dict) else {}))
+            self.plausibility.reset(time.time(), self.lastValue)
+        else:
+            self.plausibility = None
 
-        topic = self.meterConf["mqttDesc"]["topics"]["currValReq"]
-        msg = json.dumps({})
+        readSchedule = self.meterConf["meterReaderDesc"].get("readSchedule")
+        self.readScheduler = ReadScheduler(**readSchedule) if readSchedule else None
 
-        resSucc, resMsg  = self.mqttClient.publish2opic(topic, msg)
-        print(resMsg)
-        
-        if not resSucc:
-            self.setError(ReaderHealthState.MQTT_ERROR, resMsg)
-            return False
+        flashSettle = self.meterConf["meterReaderDesc"].get("flashSettle")
+        if flashSettle not in (None, False):
+            # true or a dict of FlashSettleDetector settings, {} for the defaults
+            self.settleDetector = FlashSettleDetector(**(flashSettle if isinstance(flashSettle, dict) else {}))
         else:
-            self.delError(ReaderHealthState.MQTT_ERROR)
+            self.settleDetector = None
 
+        self.setUpCamera()
+        self.setUpMqtt()
 
         # Load TFLite model and allocate tensors.
         try:
-            self.cnnInterpreter = tf.lite.Interpreter(model_path="DigitNumberModel.tflite")
-                    
-            # Get input and output tensors.
-            self.modelInputDict = self.cnnInterpreter.get_input_details()
-            self.modelOutputDict = self.cnnInterpreter.get_output_details()
-                    
-            self.cnnInterpreter.allocate_tensors()
+            self.setUpCnn()
         except:
             msg = "Could not set up CNN interpreter!"
             self.setError(ReaderHealthState.CNN_ERROR, msg)
             print(msg)
 
+        # Without a broker the meter keeps reading, the outbox holds the reports until it is back
+        topic = self.meterConf["mqttDesc"]["topics"]["currValReq"]
+        msg = json.dumps({})
+
+        resSucc, resMsg  = self.mqttClient.publish2opic(topic, msg)
+        print(resMsg)
+        
+        if not resSucc:
+            self.setError(ReaderHealthState.MQTT_ERROR, resMsg)
+        else:
+            self.delError(ReaderHealthState.MQTT_ERROR)
+
     
 
 #-------------------------------------------------------------------
@@ -270,12 +708,17 @@ class MeterReader():
 #-------------------------------------------------------------------
 
 
-mr = MeterReader()
+if __name__ == "__main__":
+    mr = MeterReader()
+
+    metricsPort = mr.meterConf.get("metricsDesc", {}).get("httpPort")
+    if metricsPort:
+        metricsServer = MetricsServer(mr.metrics, metricsPort)
 
-while True:
-    mr.checkErrStreak()
-    mr.readMeter()
-    time.sleep(mr.meterConf["meterReaderDesc"]["timeBtwRounds"])
+    while True:
+        mr.checkErrStreak()
+        mr.readMeter()
+        time.sleep(mr.nextRoundDelay())
     
 
 
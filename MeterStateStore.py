@@ -0,0 +1,118 @@
+import os
+import struct
+import time
+import zlib
+
+
+class MeterStateStore():
+    """Append-only journal of the running meter counter.
+
+    Every accepted reading is appended as a small fixed-size record with a
+    checksum, so a crash can only tear the last record, which is skipped on
+    load. Records are fsynced in batches, and the journal is compacted to its
+    last record by writing a temporary file and renaming it over the old one.
+    """
+    # timestamp, value, delta, seed (initMeterVal the counter was started from), crc32
+    _record = struct.Struct("<ddddI")
+
+    def __init__(self, path, syncEvery=30, syncInterval=300.0, maxRecords=4096) -> None:
+
+        self.path = path
+        self.syncEvery = syncEvery
+        self.syncInterval = syncInterval
+        self.maxRecords = maxRecords
+
+        self._fd = None
+        self._records = 0
+        self._pending = 0
+        self._lastSync = time.monotonic()
+        self._lastState = None
+
+    def _pack(self, ts, value, delta, seed):
+        payload = self._record.pack(ts, value, delta, seed, 0)[:-4]
+        return payload + struct.pack("<I", zlib.crc32(payload))
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def load(self):
+        """Return the last intact (timestamp, value, delta, seed) record, or None if there is none"""
+        self._lastState = None
+        self._records = 0
+
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+
+        recSize = self._record.size
+        self._records = len(data) // recSize
+
+        for pos in range((self._records - 1) * recSize, -1, -recSize):
+            rec = data[pos:pos+recSize]
+            if zlib.crc32(rec[:-4]) == struct.unpack("<I", rec[-4:])[0]:
+                self._lastState = self._record.unpack(rec)[:4]
+                break
+
+        # Drop a torn tail so that new records stay aligned
+        if len(data) % recSize or (self._lastState is None and data):
+            self.compact()
+
+        return self._lastState
+
+    def append(self, value, delta, seed):
+        if self._lastState is not None and self._lastState[1:] == (value, delta, seed):
+            self.sync(force=False)
+            return
+
+        if self._fd is None:
+            self._open()
+
+        self._lastState = (time.time(), value, delta, seed)
+        os.write(self._fd, self._pack(*self._lastState))
+        self._records += 1
+        self._pending += 1
+
+        if self._records > self.maxRecords:
+            self.compact()
+        else:
+            self.sync(force=False)
+
+    def sync(self, force=True):
+        if self._fd is None or not self._pending:
+            return
+
+        if force or self._pending >= self.syncEvery or time.monotonic() - self._lastSync >= self.syncInterval:
+            os.fsync(self._fd)
+            self._pending = 0
+            self._lastSync = time.monotonic()
+
+    def compact(self):
+        """Rewrite the journal atomically so it only holds the last state"""
+        self.close()
+
+        tmpPath = self.path + ".tmp"
+        with open(tmpPath, 'wb') as f:
+            if self._lastState is not None:
+                f.write(self._pack(*self._lastState))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, self.path)
+
+        # Persist the rename itself
+        dirFd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(dirFd)
+        finally:
+            os.close(dirFd)
+
+        self._records = 0 if self._lastState is None else 1
+        self._pending = 0
+        self._lastSync = time.monotonic()
+
+    def close(self):
+        if self._fd is not None:
+            self.sync()
+            os.close(self._fd)
+            self._fd = None
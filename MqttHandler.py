@@ -1,7 +1,120 @@
 from paho.mqtt import client as mqtt_client
+import json
+import queue
 import random
+import sqlite3
 import threading
 import time
+import zlib
+
+
+class MqttOutbox():
+    """Bounded, ordered store-and-forward queue of outgoing messages backed by sqlite.
+
+    With a file the queue survives restarts, without one it is kept in memory.
+    When maxSize is reached the policy decides what is lost: "dropOldest"
+    evicts the oldest message, "dropNewest" rejects the new one and
+    "coalesce" keeps only the newest message per topic (then the oldest).
+    """
+    POLICIES = ("dropOldest", "dropNewest", "coalesce")
+
+    def __init__(self, path=None, maxSize=1000, policy="dropOldest"):
+
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown outbox policy '{policy}', use one of {self.POLICIES}")
+
+        self.maxSize = maxSize
+        self.policy = policy
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "topic TEXT NOT NULL, payload BLOB, qos INTEGER NOT NULL, ts REAL NOT NULL)")
+        self._depth = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+        self.dropped = 0
+
+    def put(self, topic, payload, qos=1):
+        """Queue a message, returns False if it was rejected by the dropNewest policy"""
+        with self._lock:
+            if self.policy == "coalesce":
+                self._depth -= self._db.execute("DELETE FROM outbox WHERE topic = ?", (topic,)).rowcount
+
+            if self._depth >= self.maxSize:
+                if self.policy == "dropNewest":
+                    self.dropped += 1
+                    return False
+                evict = self._depth - self.maxSize + 1
+                self._db.execute("DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)", (evict,))
+                self._depth -= evict
+                self.dropped += evict
+
+            self._db.execute("INSERT INTO outbox (topic, payload, qos, ts) VALUES (?, ?, ?, ?)",
+                             (topic, payload, qos, time.time()))
+            self._depth += 1
+            return True
+
+    def peek(self, count):
+        """The oldest count messages as (id, topic, payload, qos) tuples"""
+        with self._lock:
+            return self._db.execute("SELECT id, topic, payload, qos FROM outbox ORDER BY id LIMIT ?", (count,)).fetchall()
+
+    def remove(self, ids):
+        with self._lock:
+            self._depth -= self._db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids]).rowcount
+
+    def depth(self):
+        return self._depth
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class TopicTrie():
+    """Subscription filters by topic level, matching supports the MQTT + and # wildcards"""
+    def __init__(self):
+        self._root = {}
+
+    def add(self, topicFilter, entry):
+        node = self._root
+        for level in topicFilter.split("/"):
+            node = node.setdefault(level, {})
+        node[None] = entry
+
+    def remove(self, topicFilter):
+        node = self._root
+        for level in topicFilter.split("/"):
+            node = node.get(level)
+            if node is None:
+                return
+        node.pop(None, None)
+
+    def match(self, topic):
+        """Entries of every filter matching the topic"""
+        levels = topic.split("/")
+        res = []
+        nodes = [self._root]
+
+        for i, level in enumerate(levels):
+            nextNodes = []
+            for node in nodes:
+                # "#" also matches the parent level, e.g. a/# matches a. Not on $SYS like topics at the root.
+                if "#" in node and None in node["#"] and not (i == 0 and level.startswith("$")):
+                    res.append(node["#"][None])
+                if level in node:
+                    nextNodes.append(node[level])
+                if "+" in node and not (i == 0 and level.startswith("$")):
+                    nextNodes.append(node["+"])
+            nodes = nextNodes
+
+        for node in nodes:
+            if None in node:
+                res.append(node[None])
+            if "#" in node and None in node["#"]:
+                res.append(node["#"][None])
+        return res
 
 
 class MqttHandler():
@@ -16,25 +129,101 @@ class MqttHandler():
         self.funcOnDisconnect = funcOnDisconnect
         self.client = None
         self.subscribeDict = {}
+        self.topicTrie = TopicTrie()
+
+        # Callbacks run on a bounded worker pool, never on the network thread. Messages
+        # of a topic always go to the same worker, so they are handled in order.
+        self.droppedMessages = 0
+        self.callbackErrors = 0
+        self._callbackQueues = [queue.Queue(mqttDesc.get("callbackQueueSize", 256)) for _ in range(mqttDesc.get("callbackWorkers", 2))]
+        self._callbackThreads = [threading.Thread(target=self._callbackLoop, args=(callbackQueue,), name=f"mqtt_callbacks_{name}_{i}", daemon=True)
+                                 for i, callbackQueue in enumerate(self._callbackQueues)]
+        for thread in self._callbackThreads:
+            thread.start()
+
+        # store-and-forward queue of the publishes that must not get lost, on disk unless file is null
+        outboxDesc = mqttDesc.get("outbox", {})
+        self.outbox = MqttOutbox(outboxDesc.get("file", f"{name}.outbox"), outboxDesc.get("maxSize", 1000), outboxDesc.get("policy", "dropOldest"))
+        self.outboxQos = outboxDesc.get("qos", 1)
+        self.outboxBatch = outboxDesc.get("batchSize", 50)
+        self.outboxSent = 0
+        self.drainRate = 0.0
+        self._drainEvent = threading.Event()
+        self._drainThread = threading.Thread(target=self._drainLoop, name=f"mqtt_outbox_{name}", daemon=True)
+        self._drainThread.start()
+
+        # counters for the diagnostics
+        self.disconnectCount = 0
+        self.reconnectCount = 0
 
         # reconnect/backoff state
         self._reconnect_delay = 1.0
         self._max_reconnect_delay = 60.0
         self._reconnect_timer = None
         self._reconnect_lock = threading.Lock()
+        self._stopped = False
 
         # try immediate connect (failures are retried in background)
         self.connectMqtt()
 
-    def subscribeTotopic(self, topic, callback=None):
+    def subscribeTotopic(self, topic, callback=None, decode=None, withTopic=False):
+        """Subscribe to a topic filter, + and # wildcards are allowed.
+
+        decode selects what the callback gets: None (default) the raw bytes, "text" a str
+        and "json" the parsed object. With withTopic it is called as
+        callback(payload, topic), otherwise as callback(payload).
+        """
         if self.client is not None:
             self.client.subscribe(topic)
             self.subscribeDict[topic] = callback
+            self.topicTrie.add(topic, (callback, decode, withTopic))
+
+    def unsubscribeFromTopic(self, topic):
+        if self.client is not None:
+            self.client.unsubscribe(topic)
+        self.subscribeDict.pop(topic, None)
+        self.topicTrie.remove(topic)
+
+    def _dispatch(self, msg):
+        entries = [entry for entry in self.topicTrie.match(msg.topic) if entry[0] is not None]
+        if not entries:
+            return
+
+        callbackQueue = self._callbackQueues[zlib.crc32(msg.topic.encode()) % len(self._callbackQueues)]
+        try:
+            callbackQueue.put_nowait((msg.topic, msg.payload, entries))
+        except queue.Full:
+            # The network thread must not wait for slow callbacks
+            self.droppedMessages += 1
+
+    def _callbackLoop(self, callbackQueue):
+        while True:
+            item = callbackQueue.get()
+            # None is the stop sentinel of stop()
+            if item is None or self._stopped:
+                break
+            topic, payload, entries = item
+            for callback, decode, withTopic in entries:
+                try:
+                    if decode == "text":
+                        value = payload.decode()
+                    elif decode == "json":
+                        value = json.loads(payload)
+                    else:
+                        value = payload
+                    if withTopic:
+                        callback(value, topic)
+                    else:
+                        callback(value)
+                except Exception:
+                    self.callbackErrors += 1
 
     def connectMqtt(self):
         # callbacks with signatures compatible with both callback API v1 and v2
         def on_connect(client, userdata, flags, rc=None, properties=None):
             # rc present in both APIs (v2 passes properties as extra arg)
+            # messages queued during the outage are sent now
+            self._drainEvent.set()
             if self.funcOnConnect:
                 try:
                     # many handlers expect rc parameter
@@ -45,7 +234,8 @@ class MqttHandler():
         
         def on_disconnect(client, userdata, rc=0, properties=None):
             # rc present in both APIs
-            if rc != 0:
+            if rc != 0 and not self._stopped:
+                self.disconnectCount += 1
                 if self.funcOnDisconnect:
                     try:
                         self.funcOnDisconnect()
@@ -55,18 +245,7 @@ class MqttHandler():
                 self._schedule_reconnect()
 
         def on_message(client, userdata, msg):
-            # message callback retained as-is
-            try:
-                payload = msg.payload.decode()
-            except Exception:
-                payload = msg.payload
-            print(f"Received message: {payload} from topic: {msg.topic}")
-            if msg.topic in self.subscribeDict.keys() and self.subscribeDict[msg.topic] is not None:
-                try:
-                    self.subscribeDict[msg.topic](payload)
-                except Exception:
-                    pass
-                
+            self._dispatch(msg)
 
         # create client (do not pass callback_api_version here; use callbacks that accept both forms)
         client = mqtt_client.Client(client_id=f"mqtt_client_{self.name}_{random.randint(1000,9999)}")
@@ -94,6 +273,9 @@ class MqttHandler():
 
     def _attempt_reconnect(self):
         with self._reconnect_lock:
+            if self._stopped:
+                return
+            self.reconnectCount += 1
             # prevent overlapping attempts
             try:
                 # create a fresh client object to avoid stale internal state
@@ -116,6 +298,8 @@ class MqttHandler():
 
     def _schedule_reconnect(self):
         with self._reconnect_lock:
+            if self._stopped:
+                return
             if self._reconnect_timer and self._reconnect_timer.is_alive():
                 return
             delay = self._reconnect_delay
@@ -124,6 +308,87 @@ class MqttHandler():
             self._reconnect_timer.start()
 
 
+    def _drainLoop(self):
+        while True:
+            self._drainEvent.wait()
+            self._drainEvent.clear()
+            if self._stopped:
+                break
+            try:
+                while self.outbox.depth() and self.client is not None and self.client.is_connected():
+                    if not self._drainBatch():
+                        break
+            except Exception as e:
+                print(f"MQTT outbox drain failed: {e}")
+
+    def _drainBatch(self):
+        """Publish the oldest batch in order, it leaves the outbox only once the broker took all of it"""
+        batch = self.outbox.peek(self.outboxBatch)
+        start = time.monotonic()
+
+        infos = []
+        for _, topic, payload, qos in batch:
+            info = self.client.publish(topic, payload, qos)
+            if info.rc != mqtt_client.MQTT_ERR_SUCCESS:
+                break
+            infos.append(info)
+
+        for info in infos:
+            try:
+                info.wait_for_publish(timeout=10)
+            except (RuntimeError, ValueError):
+                break
+
+        # at-least-once and in order: only the acknowledged head of the batch leaves the outbox
+        done = []
+        for row, info in zip(batch, infos):
+            if not info.is_published():
+                break
+            done.append(row[0])
+        self.outbox.remove(done)
+
+        self.outboxSent += len(done)
+        elapsed = time.monotonic() - start
+        if done and elapsed > 0:
+            self.drainRate = len(done) / elapsed
+
+        return len(done) == len(batch)
+
+    def stop(self):
+        """Disconnect and end the background threads, the outbox keeps the unsent messages"""
+        with self._reconnect_lock:
+            self._stopped = True
+            if self._reconnect_timer:
+                self._reconnect_timer.cancel()
+                self._reconnect_timer = None
+
+        if self.client is not None:
+            self.client.disconnect()
+            self.client.loop_stop()
+
+        self._drainEvent.set()
+        self._drainThread.join(timeout=5)
+        self.outbox.close()
+
+        for callbackQueue in self._callbackQueues:
+            try:
+                callbackQueue.put(None, timeout=1)
+            except queue.Full:
+                # A worker stuck in a callback leaves the loop with its next message
+                pass
+        for thread in self._callbackThreads:
+            thread.join(timeout=5)
+
+    def publishQueued(self, topic, msg):
+        """Store-and-forward publish, the message is kept in the outbox until the broker acknowledges it"""
+        if not self.outbox.put(topic, msg, self.outboxQos):
+            return False, f"Outbox full, dropped message to topic {topic}"
+
+        self._drainEvent.set()
+        if self.client is None or not self.client.is_connected():
+            return False, f"Queued message to topic {topic}, not connected to any broker ({self.outbox.depth()} waiting)"
+        return True, f"Queued topic: {topic}"
+
     def publish2opic(self, topic, msg):
         resSucc = False
         resMsg = "Not connected to any broker!"
@@ -0,0 +1,157 @@
+import numpy as np
+
+
+class PlausibilityFilter():
+    """Plausibility check of new readings against a fixed-size history of accepted ones.
+
+    The history is a ring of (timestamp, value, confidence) arrays. A reading
+    is rejected if it drops below the last accepted value by more than
+    decreaseTol, or if it rises faster than the constant flow model expects:
+    last value + estimated flow * elapsed time, plus stepThresh and maxRate
+    (units per hour) * elapsed time. The flow is tracked by an alpha-beta
+    (steady-state Kalman) filter.
+
+    After recoverAfter consecutive rejected readings that are consistent
+    among themselves (non-decreasing, within the step limit of each other and
+    not below the rolling median of the history), the filter accepts them and
+    continues from there. That heals a single bad accepted value or a real
+    jump without a restart. The history before a recovery is kept until the
+    window is refilled: consistent readings below the recovered ones, but not
+    below the median of that older history, undo a recovery that followed a
+    wrong plateau.
+    """
+    def __init__(self, stepThresh, window=16, maxRate=None, decreaseTol=0.0, recoverAfter=3, alpha=0.5, beta=0.1):
+
+        self.stepThresh = stepThresh
+        self.window = window
+        self.maxRate = maxRate
+        self.decreaseTol = decreaseTol
+        self.recoverAfter = recoverAfter
+        self.alpha = alpha
+        self.beta = beta
+
+        self.ts = np.zeros(window)
+        self.values = np.zeros(window)
+        self.conf = np.zeros(window)
+        self.pos = 0
+        self.count = 0
+
+        # alpha-beta state: value level and flow per second
+        self.level = 0.0
+        self.rate = 0.0
+
+        self._rejected = []
+        # History before the last recovery and readings accepted since
+        self._preRecovery = None
+        self._sinceRecovery = 0
+
+    def reset(self, ts, value, conf=1.0):
+        """Drop the history and continue from a trusted value"""
+        self.count = 0
+        self.pos = 0
+        self.level = value
+        self.rate = 0.0
+        self._rejected = []
+        self._preRecovery = None
+        self._push(ts, value, conf)
+
+    def _snapshot(self):
+        return (self.ts.copy(), self.values.copy(), self.conf.copy(), self.pos, self.count, self.level, self.rate)
+
+    def _restore(self, snapshot):
+        ts, values, conf, self.pos, self.count, self.level, self.rate = snapshot
+        self.ts, self.values, self.conf = ts.copy(), values.copy(), conf.copy()
+        self._rejected = []
+        self._preRecovery = None
+
+    def _push(self, ts, value, conf):
+        self.ts[self.pos] = ts
+        self.values[self.pos] = value
+        self.conf[self.pos] = conf
+        self.pos = (self.pos + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+
+    def last(self):
+        idx = (self.pos - 1) % self.window
+        return self.ts[idx], self.values[idx]
+
+    def median(self, snapshot=None):
+        values, count = (snapshot[1], snapshot[4]) if snapshot is not None else (self.values, self.count)
+        return float(np.median(values[:count]))
+
+    def _limit(self, dt):
+        return self.stepThresh + (self.maxRate * dt / 3600 if self.maxRate is not None else 0.0)
+
+    def _track(self, ts, value, conf):
+        lastTs, _ = self.last()
+        dt = max(ts - lastTs, 1e-3)
+
+        # Less confident readings move the estimate less
+        predicted = self.level + self.rate * dt
+        residual = value - predicted
+        self.level = predicted + self.alpha * conf * residual
+        self.rate = max(0.0, self.rate + self.beta * conf * residual / dt)
+
+        self._push(ts, value, conf)
+
+    def check(self, ts, value, conf=1.0):
+        """Returns (accepted, message), accepted readings are added to the history"""
+        if self.count == 0:
+            self.reset(ts, value, conf)
+            return True, ""
+
+        lastTs, lastValue = self.last()
+        dt = max(ts - lastTs, 0.0)
+        expected = lastValue + self.rate * dt
+        limit = self._limit(dt)
+
+        if value < lastValue - self.decreaseTol:
+            msg = f"Sensor value must not decrease. Value:({value}), last accepted: {lastValue}"
+        elif value - expected > limit:
+            msg = f"Value read ({value}) is not plausible as change is larger than the limit: ({limit}) above the expected {round(expected, 3)}"
+        else:
+            self._rejected = []
+            self._track(ts, value, conf)
+            if self._preRecovery is not None:
+                self._sinceRecovery += 1
+                if self._sinceRecovery >= self.window:
+                    self._preRecovery = None
+            return True, ""
+
+        if self._recover(ts, value, conf):
+            return True, f"Recovered from {lastValue} to {value} after {self.recoverAfter} consistent readings."
+        return False, msg
+
+    def _recover(self, ts, value, conf):
+        self._rejected.append((ts, value, conf))
+        if len(self._rejected) < self.recoverAfter:
+            return False
+        self._rejected = self._rejected[-self.recoverAfter:]
+
+        for (ts0, v0, _), (ts1, v1, _) in zip(self._rejected, self._rejected[1:]):
+            if v1 < v0 - self.decreaseTol or v1 - v0 > self._limit(ts1 - ts0):
+                return False
+
+        rejected = self._rejected
+        # Readings below a recovered plateau are checked against the history from before it
+        undo = self._preRecovery is not None and rejected[0][1] < self.last()[1] - self.decreaseTol
+        history = self._preRecovery if undo else None
+        count = history[4] if undo else self.count
+
+        # A high outlier in the history does not move the median, so low but correct readings pass
+        floor = self.median(history) - self.decreaseTol if count > 2 else -np.inf
+        if rejected[0][1] < floor:
+            return False
+
+        if undo:
+            self._restore(history)
+            for reading in rejected:
+                self._track(*reading)
+        else:
+            snapshot = self._snapshot()
+            self.reset(*rejected[0])
+            for reading in rejected[1:]:
+                self._track(*reading)
+            self._preRecovery = snapshot
+            self._sinceRecovery = 0
+        return True
@@ -0,0 +1,79 @@
+"""Convert the trained digit model into a fully integer quantized TFLite model.
+
+Needs full TensorFlow and the trained model as SavedModel directory or Keras
+file, the .tflite file cannot be converted again. The representative dataset
+that calibrates the quantization ranges is built from our own crops: .npz
+shards exported by CropArchive.py and/or directories of crop images.
+
+    python QuantizeModel.py MODEL --data shards [--data crops_dir] [--samples 500] [--out DigitNumberModel_int8.tflite]
+
+Select the result with meterReaderDesc.modelPath, compare it with
+benchmarks/bench_model.py.
+"""
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def loadCrops(paths, cropSize=(20,32)):
+    """32x20x3 uint8 crops of .npz shards (crops array), image files and directories of both"""
+    crops = []
+    for path in paths:
+        if os.path.isdir(path):
+            crops.extend(loadCrops([os.path.join(path, n) for n in sorted(os.listdir(path))], cropSize))
+        elif path.endswith(".npz"):
+            with np.load(path) as shard:
+                crops.extend(shard["crops"])
+        elif path.lower().endswith(IMAGE_EXTS):
+            img = cv2.imread(path)
+            if img is not None:
+                crops.append(cv2.resize(img, cropSize))
+    return crops
+
+
+def convert(modelPath, crops, ioType="int8"):
+    import tensorflow as tf
+
+    if os.path.isdir(modelPath):
+        converter = tf.lite.TFLiteConverter.from_saved_model(modelPath)
+    else:
+        converter = tf.lite.TFLiteConverter.from_keras_model(tf.keras.models.load_model(modelPath))
+
+    def representativeDataset():
+        # Same float 0..255 input the float model is fed with
+        for crop in crops:
+            yield [crop[np.newaxis].astype(np.float32)]
+
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representativeDataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = getattr(tf, ioType)
+    converter.inference_output_type = getattr(tf, ioType)
+
+    return converter.convert()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", help="SavedModel directory or Keras .h5 / .keras file of the digit model")
+    parser.add_argument("--data", action="append", required=True, help="crop shards (.npz), images or directories")
+    parser.add_argument("--samples", type=int, default=500, help="crops used for the calibration")
+    parser.add_argument("--io-type", choices=("int8", "uint8"), default="int8")
+    parser.add_argument("--out", default="DigitNumberModel_int8.tflite")
+    args = parser.parse_args()
+
+    crops = loadCrops(args.data)
+    if not crops:
+        raise SystemExit("No crops found for the representative dataset.")
+
+    rng = np.random.default_rng(0)
+    sample = [crops[i] for i in rng.permutation(len(crops))[:args.samples]]
+
+    tfliteModel = convert(args.model, sample, args.io_type)
+    with open(args.out, 'wb') as f:
+        f.write(tfliteModel)
+    print(f"Quantized model written to {args.out} ({len(tfliteModel)/1024:.0f} kB, {len(sample)} calibration crops)")
@@ -0,0 +1,27 @@
+class ReadScheduler():
+    """Read interval following the consumption instead of a fixed timeBtwRounds.
+
+    While the value changes by more than idleDelta per reading the meter is
+    read every minInterval. Every idle reading multiplies the interval by
+    backoff, up to maxInterval, which is the heartbeat: a meter is read and
+    reported at least that often. Failed readings are retried after minInterval.
+    """
+    def __init__(self, minInterval=30, maxInterval=600, backoff=2.0, idleDelta=0.0):
+
+        if not 0 < minInterval <= maxInterval:
+            raise ValueError(f"Invalid read schedule bounds: {minInterval} - {maxInterval}")
+
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.backoff = backoff
+        self.idleDelta = idleDelta
+
+        self.interval = minInterval
+
+    def nextInterval(self, delta, isOk=True):
+        """Seconds until the next reading, delta is the change of the last reading"""
+        if not isOk or abs(delta) > self.idleDelta:
+            self.interval = self.minInterval
+        else:
+            self.interval = min(self.interval * self.backoff, self.maxInterval)
+        return self.interval
@@ -0,0 +1,170 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bucket bounds in seconds, shared by all histograms
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram():
+    """Fixed bucket histogram, observing a value is a bisect and two additions"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry():
+    """Low-overhead counters, gauges and histograms of the reader.
+
+    Every metric is identified by its name and a set of labels, e.g.
+    meter="gas", stage="capture". The registry renders itself in the
+    Prometheus text format and as a plain dict for the MQTT diagnostics topic.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def setGauge(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _fmtLabels(labels, extra=()):
+        items = [*labels, *extra]
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+    def renderPrometheus(self):
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                header(name, "counter")
+                lines.append(f"{name}{self._fmtLabels(labels)} {value}")
+
+            for (name, labels), value in sorted(self._gauges.items()):
+                header(name, "gauge")
+                lines.append(f"{name}{self._fmtLabels(labels)} {value}")
+
+            for (name, labels), hist in sorted(self._histograms.items(), key=lambda item: item[0]):
+                header(name, "histogram")
+                cumulative = 0
+                for bound, cnt in zip((*hist.buckets, "+Inf"), hist.counts):
+                    cumulative += cnt
+                    lines.append(f"{name}_bucket{self._fmtLabels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{self._fmtLabels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{self._fmtLabels(labels)} {hist.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, **match):
+        """Dict of the metrics whose labels contain all the given ones, histograms are reduced to count/sum/mean"""
+        matchItems = set(match.items())
+        res = {}
+
+        def keyStr(name, labels):
+            rest = [f"{k}={v}" for k, v in labels if (k, v) not in matchItems]
+            return name + (f"[{','.join(rest)}]" if rest else "")
+
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                if matchItems <= set(labels):
+                    res[keyStr(name, labels)] = value
+            for (name, labels), value in self._gauges.items():
+                if matchItems <= set(labels):
+                    res[keyStr(name, labels)] = value
+            for (name, labels), hist in self._histograms.items():
+                if matchItems <= set(labels):
+                    res[keyStr(name, labels)] = {"count": hist.count, "sum": round(hist.sum, 6),
+                                                 "mean": round(hist.sum / hist.count, 6) if hist.count else 0}
+        return res
+
+
+def timedStage(stage):
+    """Method decorator observing the run time of a reader stage in its metrics registry"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.metrics.observe("meter_reader_stage_seconds", time.perf_counter() - start, meter=self.name, stage=stage)
+        return wrapper
+    return decorator
+
+
+class MetricsServer():
+    """Serves the registry as Prometheus text on http://<host>:<port>/metrics from a daemon thread"""
+    def __init__(self, registry, port, host="0.0.0.0"):
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.renderPrometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # No console output per scrape
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics_server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,154 @@
+import os
+import threading
+
+import numpy as np
+
+
+RECORD_DTYPE = np.dtype([("ts", "<f8"), ("value", "<f8"), ("delta", "<f8"), ("health", "<u4"), ("pad", "<u4")])
+ROLLUP_DTYPE = np.dtype([("ts", "<f8"), ("count", "<u4"), ("health", "<u4"), ("min", "<f8"), ("max", "<f8"),
+                         ("first", "<f8"), ("last", "<f8"), ("delta", "<f8")])
+
+
+class SegmentedArray():
+    """Append-only array of fixed-width records in preallocated memory-mapped segment files.
+
+    Records are appended in timestamp order, a zero ts marks the unused tail
+    of the last segment. Segments are named <prefix>_<n>.seg.
+    """
+    def __init__(self, path, prefix, dtype, segmentRecords=65536):
+
+        self.path = path
+        self.prefix = prefix
+        self.dtype = dtype
+        self.segmentRecords = segmentRecords
+
+        names = sorted((n for n in os.listdir(path) if n.startswith(prefix + "_") and n.endswith(".seg")),
+                       key=lambda n: int(n[len(prefix)+1:-4]))
+        self.segments = [np.memmap(os.path.join(path, n), dtype=dtype, mode="r+") for n in names]
+        self.fill = int(np.count_nonzero(self.segments[-1]["ts"])) if self.segments else 0
+
+    def __len__(self):
+        return max(len(self.segments) - 1, 0) * self.segmentRecords + self.fill
+
+    def _newSegment(self):
+        fileName = os.path.join(self.path, f"{self.prefix}_{len(self.segments)}.seg")
+        self.segments.append(np.memmap(fileName, dtype=self.dtype, mode="w+", shape=(self.segmentRecords,)))
+        self.fill = 0
+
+    def append(self, record):
+        if not self.segments or self.fill == self.segmentRecords:
+            self._newSegment()
+        self.segments[-1][self.fill] = record
+        self.fill += 1
+
+    def last(self):
+        """The last record as a tuple, None if empty"""
+        if not len(self):
+            return None
+        if self.fill == 0:
+            return self.segments[-2][-1].item()
+        return self.segments[-1][self.fill-1].item()
+
+    def setLast(self, record):
+        if self.fill == 0:
+            self.segments[-2][-1] = record
+        else:
+            self.segments[-1][self.fill-1] = record
+
+    def _slices(self, start, end):
+        for i, seg in enumerate(self.segments):
+            used = seg[:self.fill] if i == len(self.segments) - 1 else seg
+            if not len(used) or used["ts"][-1] < start or used["ts"][0] >= end:
+                continue
+            lo, hi = np.searchsorted(used["ts"], [start, end])
+            yield used[lo:hi]
+
+    def count(self, start, end):
+        return sum(len(part) for part in self._slices(start, end))
+
+    def range(self, start, end):
+        """Records with start <= ts < end, as one array"""
+        parts = list(self._slices(start, end))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=self.dtype)
+
+    def flush(self):
+        for seg in self.segments:
+            seg.flush()
+
+
+class ReadingHistory():
+    """Local time series of the readings with per minute, hour and day rollups.
+
+    Every round is appended as a (ts, value, delta, health) record, delta is
+    the change to the previous record. The rollups are updated in place while
+    their bucket is open, so a downsampled query reads only the rollup
+    records of the range.
+    """
+    RESOLUTIONS = (60, 3600, 86400)
+
+    def __init__(self, path, segmentRecords=65536):
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+        self._lock = threading.Lock()
+        self.raw = SegmentedArray(path, "raw", RECORD_DTYPE, segmentRecords)
+        self.rollups = {res: SegmentedArray(path, f"rollup_{res}", ROLLUP_DTYPE, max(segmentRecords // 16, 1024))
+                        for res in self.RESOLUTIONS}
+
+        # Last raw record and open rollup buckets are kept as tuples, an append writes each record once
+        self._last = self.raw.last()
+        self._open = {res: rollup.last() for res, rollup in self.rollups.items()}
+
+    def append(self, ts, value, health=0):
+        with self._lock:
+            if self._last is not None and ts <= self._last[0]:
+                # The store is kept in time order, a clock step back is not recorded
+                return
+            delta = value - self._last[1] if self._last is not None else 0.0
+            self._last = (ts, value, delta, health, 0)
+            self.raw.append(self._last)
+
+            for res, rollup in self.rollups.items():
+                bucket = ts - ts % res
+                rec = self._open[res]
+                if rec is not None and rec[0] == bucket:
+                    rec = (bucket, rec[1] + 1, rec[2] | health, min(rec[3], value), max(rec[4], value), rec[5], value, rec[7] + delta)
+                    rollup.setLast(rec)
+                else:
+                    rec = (bucket, 1, health, value, value, value, value, delta)
+                    rollup.append(rec)
+                self._open[res] = rec
+
+    def query(self, start, end, resolution=None, maxPoints=None):
+        """Records of [start, end) as columns.
+
+        resolution 0 returns the raw readings, 60 / 3600 / 86400 the rollups.
+        Without a resolution the finest one with at most maxPoints records is used.
+        """
+        with self._lock:
+            if resolution is None:
+                series = [self.raw, *self.rollups.values()]
+                for resolution, arr in zip((0, *self.RESOLUTIONS), series):
+                    if maxPoints is None or arr.count(start, end) <= maxPoints:
+                        break
+            records = self._records(resolution, start, end)
+
+            cols = {"resolution": resolution}
+            for name in records.dtype.names:
+                if name != "pad":
+                    cols[name] = records[name].tolist()
+            return cols
+
+    def _records(self, resolution, start, end):
+        if resolution == 0:
+            return self.raw.range(start, end)
+        if resolution not in self.rollups:
+            raise ValueError(f"Unknown resolution {resolution}, use 0 or one of {self.RESOLUTIONS}")
+        return self.rollups[resolution].range(start, end)
+
+    def flush(self):
+        with self._lock:
+            self.raw.flush()
+            for rollup in self.rollups.values():
+                rollup.flush()
@@ -0,0 +1,295 @@
+"""Headless detection of the digit masks and imgRot of a meter.
+
+Finds the rotation, the digit window and the single wheels of a frame with
+projection profiles and writes meterReaderDesc.imgRot and imgMaskDesc.digMasks
+to the config, without a display:
+
+1. imgRot is the angle that makes the row profile of the horizontal edges
+   sharpest, the window borders and the digits are level there.
+   It is corrected by the slope of the digits found in step 2.
+2. The rows of the rotated frame with the most vertical edge energy are the
+   digit window candidates. Each is split into the digitSize wheels by its
+   column profile: the pitch from its autocorrelation, the position from
+   where the wheels at that pitch catch the most edge energy.
+3. The crops of the candidate layouts are classified in batches, the layout
+   with the most confident digits wins.
+
+    python RoiDetector.py MeterToolConf.json [--image frame.png] [--meter gas] [--max-angle 10] [--dry-run] [--debug out.png]
+
+Without --image a frame is taken from cameraDesc.camUrl.
+"""
+import argparse
+import codecs
+import json
+
+import cv2
+import numpy as np
+
+from InferenceBackend import loadInterpreter
+from DigitClassifier import DigitClassifier
+from DigitCropper import DigitCropper
+
+# Mask width as share of the wheel pitch and vertical padding as share of the digit height,
+# the first ones are used to rank the layouts and win ties
+WIDTH_FRACS = (0.75, 0.6, 0.9)
+PAD_FRACS = (0.4, 0.2, 0.6)
+# Searches of the digit layouts, each after correcting the angle by the slope of the previous digits
+ANGLE_PASSES = 3
+
+
+def smooth(profile, size):
+    size = max(int(size), 1)
+    return np.convolve(profile, np.ones(size) / size, mode="same")
+
+
+def topPeaks(arr, count, minDist):
+    """Indices of the count highest local maxima, at least minDist apart"""
+    work = np.asarray(arr, dtype=np.float64).copy()
+    minDist = max(int(minDist), 1)
+    peaks = []
+    for _ in range(count):
+        idx = int(np.argmax(work))
+        if not np.isfinite(work[idx]):
+            break
+        peaks.append(idx)
+        work[max(idx - minDist, 0):idx + minDist + 1] = -np.inf
+    return peaks
+
+
+def estimateRotation(gray, maxAngle=10.0, step=0.5, fineStep=0.1, width=320):
+    """imgRot that levels the frame, from the sharpness of the horizontal edge row profile"""
+    scale = min(width / gray.shape[1], 1.0)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    edges = np.abs(cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=3))
+    h, w = edges.shape
+
+    def sharpness(angle):
+        rotM = cv2.getRotationMatrix2D(center=(w/2, h/2), angle=float(angle), scale=1)
+        profile = cv2.warpAffine(edges, rotM, (w, h)).sum(axis=1)
+        return np.square(profile).sum() / max(profile.sum(), 1e-6)**2
+
+    coarse = np.arange(-maxAngle, maxAngle + step/2, step)
+    best = coarse[np.argmax([sharpness(a) for a in coarse])]
+    fine = np.arange(best - step, best + step + fineStep/2, fineStep)
+    return round(float(fine[np.argmax([sharpness(a) for a in fine])]), 1)
+
+
+def findBands(gx, maxBands=3, minHeight=8):
+    """(top, bottom) row ranges with the most vertical edge energy, strongest first"""
+    h = gx.shape[0]
+    profile = smooth(gx.sum(axis=1), h / 60)
+    work = profile.copy()
+
+    bands = []
+    for _ in range(maxBands):
+        peak = int(np.argmax(work))
+        if work[peak] <= 0:
+            break
+        below = profile < 0.5 * profile[peak]
+        top = int(np.flatnonzero(below[:peak])[-1]) + 1 if below[:peak].any() else 0
+        bottom = peak + int(np.argmax(below[peak:])) if below[peak:].any() else h
+
+        # The neighbourhood of a band is not searched again
+        height = bottom - top
+        work[max(top - height, 0):bottom + height] = 0
+        if height >= minHeight:
+            bands.append((top, bottom))
+    return bands
+
+
+def wheelLayouts(gx, band, count, maxPitches=2, maxStarts=3):
+    """Candidate (centers, pitch) of count wheels in a band.
+
+    The pitch comes from the autocorrelation of the column profile, the
+    position from where count glyph-wide windows at that pitch catch the most
+    edge energy. Each wheel is then snapped to the ink centroid around it.
+    """
+    top, bottom = band
+    height = bottom - top
+    profile = smooth(gx[top:bottom].sum(axis=0), height / 10)
+    w = len(profile)
+
+    def centroid(center, radius):
+        start, end = int(max(center - radius, 0)), int(min(center + radius + 1, w))
+        weights = profile[start:end]
+        if weights.sum() <= 0:
+            return center
+        return float(np.dot(np.arange(start, end), weights) / weights.sum())
+
+    centered = profile - profile.mean()
+    autoCorr = np.correlate(centered, centered, mode="full")[w-1:]
+    lags = np.arange(len(autoCorr))
+    valid = (lags >= 0.5 * height) & (lags <= 4 * height) & (lags * count < w)
+    autoCorr = np.where(valid, autoCorr, -np.inf)
+    # Only rising and falling neighbours make a peak, not the edge of the valid range
+    isPeak = np.zeros(w, dtype=bool)
+    isPeak[1:-1] = (autoCorr[1:-1] >= autoCorr[:-2]) & (autoCorr[1:-1] >= autoCorr[2:])
+    pitches = [lag for lag in topPeaks(np.where(isPeak, autoCorr, -np.inf), maxPitches, 0.2 * height)]
+
+    layouts = []
+    for pitch in pitches:
+        glyph = smooth(profile, 0.6 * pitch)
+        offsets = np.round(np.arange(count) * pitch).astype(int)
+        energy = glyph[np.arange(w - offsets[-1])[:, np.newaxis] + offsets].sum(axis=1)
+        for start in topPeaks(energy, maxStarts, pitch / 2):
+            # Every wheel has a digit, a layout reaching over the window has an empty one
+            ink = glyph[start + offsets]
+            if ink.min() >= 0.25 * np.median(ink):
+                centers = np.array([centroid(start + offset, pitch / 3) for offset in offsets])
+                layouts.append((centers, float(pitch)))
+    return layouts
+
+
+def layoutSkew(gx, centers, pitch, band):
+    """Rotation the estimate missed in degrees, from the line through the vertical digit centers"""
+    top, bottom = band
+    height = bottom - top
+    rowStart = max(top - height // 2, 0)
+
+    mids = []
+    for cx in centers:
+        profile = gx[rowStart:bottom + height // 2, int(max(cx - 0.3 * pitch, 0)):int(cx + 0.3 * pitch) + 1].sum(axis=1)
+        rows = np.flatnonzero(profile >= 0.3 * profile.max())
+        # Digits are equally high, the middle of their extent does not depend on the glyph shape
+        mids.append(rowStart + (rows[0] + rows[-1]) / 2 if len(rows) else np.nan)
+
+    mids = np.array(mids)
+    valid = ~np.isnan(mids)
+    if valid.sum() < 2:
+        return 0.0
+    slope = np.polyfit(np.asarray(centers)[valid], mids[valid], 1)[0]
+    return float(np.degrees(np.arctan(slope)))
+
+
+def layoutMasks(centers, pitch, band, powers, frameShape, widthFrac, padFrac):
+    h, w = frameShape[:2]
+    top, bottom = band
+    pad = padFrac * (bottom - top)
+    half = widthFrac * pitch / 2
+    y0, y1 = int(max(top - pad, 0)), int(min(bottom + pad, h - 1))
+    return {powa: [[int(max(cx - half, 0)), y0], [int(min(cx + half, w - 1)), y1]] for powa, cx in zip(powers, centers)}
+
+
+def digitPowers(digitSize):
+    """Mask keys from left to right, e.g. 4 .. -3 for digitSize [5, 3]"""
+    whole, frac = digitSize
+    return [str(p) for p in range(whole - 1, -frac - 1, -1)]
+
+
+def scoreLayouts(classifier, frame, angle, candidates):
+    """Geometric mean of the top digit probabilities of every layout and the probabilities"""
+    # Crops are taken from the raw frame like in the reader, all layouts with one remap and one interpreter call
+    rects = {i: rect for i, rect in enumerate(rect for masks in candidates for rect in masks.values())}
+    crops = DigitCropper().crop(frame, angle, rects)
+    probs = classifier.predict(crops).reshape(len(candidates), len(candidates[0]), -1)
+
+    # Rounded, so practically equal layouts are decided by their order
+    scores = np.exp(np.log(probs.max(axis=2) + 1e-6).mean(axis=1)).round(4)
+    return scores, probs
+
+
+def detectMasks(frame, digitSize, classifier, maxAngle=10.0, maxBands=3, refine=3):
+    """Returns the best layout as dict of imgRot, digMasks, score, digits and probs"""
+    powers = digitPowers(digitSize)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+    h, w = gray.shape
+    angle = estimateRotation(gray, maxAngle)
+
+    for attempt in range(ANGLE_PASSES):
+        rotM = cv2.getRotationMatrix2D(center=(w/2, h/2), angle=angle, scale=1)
+        gx = np.abs(cv2.Sobel(cv2.warpAffine(gray, rotM, (w, h)), cv2.CV_32F, 1, 0, ksize=3))
+
+        layouts = [(centers, pitch, band) for band in findBands(gx, maxBands)
+                   for centers, pitch in wheelLayouts(gx, band, len(powers))]
+        if not layouts:
+            return None
+
+        # Layouts are ranked with one mask size, only the best few are tried with every size
+        scores, _ = scoreLayouts(classifier, frame, angle,
+                                 [layoutMasks(*layout, powers, frame.shape, WIDTH_FRACS[0], PAD_FRACS[0]) for layout in layouts])
+
+        # With little else level in the frame the estimate can be off, the digits themselves tell
+        skew = layoutSkew(gx, *layouts[int(np.argmax(scores))])
+        # The layouts are only valid for the angle they were found at, the last pass keeps it
+        if abs(skew) < 0.2 or attempt == ANGLE_PASSES - 1:
+            break
+        angle = round(angle + skew, 1)
+
+    candidates = [layoutMasks(*layouts[i], powers, frame.shape, widthFrac, padFrac)
+                  for i in np.argsort(-scores, kind="stable")[:refine] for widthFrac in WIDTH_FRACS for padFrac in PAD_FRACS]
+    scores, probs = scoreLayouts(classifier, frame, angle, candidates)
+    best = int(np.argmax(scores))
+
+    return {"imgRot": angle, "digMasks": candidates[best], "score": float(scores[best]),
+            "digits": probs[best].argmax(axis=1).tolist(), "probs": probs[best].max(axis=1).round(3).tolist(),
+            "candidates": len(layouts) + len(candidates)}
+
+
+def grabFrame(camUrl, timeout):
+    from CameraGrabber import CameraGrabber
+
+    camera = CameraGrabber(camUrl, "roi_detector")
+    try:
+        frame, _ = camera.getFrame(timeout=timeout)
+    finally:
+        camera.stop()
+    return frame
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("conf", help="MeterToolConf.json, imgRot and digMasks are written to it")
+    parser.add_argument("--image", help="frame of the meter, default a frame of cameraDesc.camUrl")
+    parser.add_argument("--meter", help="meter of a MeterEngine config with a meters key")
+    parser.add_argument("--digit-size", type=int, nargs=2, metavar=("WHOLE", "FRACTION"),
+                        help="digits before and after the decimal point, default imgMaskDesc.digitSize")
+    parser.add_argument("--max-angle", type=float, default=10.0, help="largest rotation searched, in degrees")
+    parser.add_argument("--bands", type=int, default=3, help="digit window candidates")
+    parser.add_argument("--dry-run", action="store_true", help="only print the result")
+    parser.add_argument("--debug", help="write the rotated frame with the masks to this image")
+    args = parser.parse_args()
+
+    with codecs.open(args.conf, 'r', 'utf-8') as jsf:
+        conf = json.load(jsf)
+    meterConf = conf["meters"][args.meter] if args.meter else conf
+    readerDesc = meterConf["meterReaderDesc"]
+
+    digitSize = args.digit_size or meterConf["imgMaskDesc"]["digitSize"]
+
+    if args.image:
+        frame = cv2.imread(args.image)
+    else:
+        frame = grabFrame(meterConf["cameraDesc"]["camUrl"], meterConf["cameraDesc"].get("frameTimeout", 5))
+    if frame is None:
+        raise SystemExit("Could not read a frame of the meter.")
+
+    # MeterEngine keeps the model settings at the top level
+    modelDesc = conf if args.meter else readerDesc
+    classifier = DigitClassifier(loadInterpreter(modelDesc.get("modelPath", "DigitNumberModel.tflite"),
+                                                 modelDesc.get("inferenceBackend", "auto")))
+
+    result = detectMasks(frame, digitSize, classifier, args.max_angle, args.bands)
+    if result is None:
+        raise SystemExit("No digit window found.")
+
+    print(f"imgRot {result['imgRot']}, {result['candidates']} layouts, score {result['score']:.3f}")
+    for (powa, rect), digit, prob in zip(result["digMasks"].items(), result["digits"], result["probs"]):
+        print(f"  {powa:>3}: {rect}  digit {digit} ({prob})")
+
+    if args.debug:
+        h, w = frame.shape[:2]
+        rotM = cv2.getRotationMatrix2D(center=(w/2, h/2), angle=result["imgRot"], scale=1)
+        debugImg = cv2.warpAffine(frame, rotM, (w, h))
+        for powa, (tl, br) in result["digMasks"].items():
+            cv2.rectangle(debugImg, tuple(tl), tuple(br), (0, 255, 0), 1)
+            cv2.putText(debugImg, powa, (tl[0], tl[1] - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 255, 0), 1)
+        cv2.imwrite(args.debug, debugImg)
+
+    if not args.dry_run:
+        readerDesc["imgRot"] = result["imgRot"]
+        meterConf["imgMaskDesc"]["digitSize"] = list(digitSize)
+        meterConf["imgMaskDesc"]["digMasks"] = result["digMasks"]
+        with open(args.conf, 'w') as f:
+            json.dump(conf, f, indent=4)
+        print(f"Masks written to {args.conf}")
@@ -0,0 +1,108 @@
+"""Top-1 accuracy and invoke latency of digit models on a held-out crop set.
+
+The crop set is read from .npz shards (CropArchive.py export, with a "labels"
+array if the crops were hand labelled, otherwise the archived "digits" are
+used), or rendered from the masks of the config with known digits.
+
+    python benchmarks/bench_model.py [--model DigitNumberModel.tflite --model DigitNumberModel_int8.tflite]
+                                     [--data shards/*.npz] [--backend auto] [--batch 8] [--repeat 200] [--json results.json]
+"""
+import argparse
+import codecs
+import json
+import os
+import sys
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from InferenceBackend import loadInterpreter
+from DigitClassifier import DigitClassifier
+from DigitCropper import DigitCropper
+
+
+def loadShards(paths):
+    crops, labels = [], []
+    for path in paths:
+        with np.load(path) as shard:
+            crops.append(shard["crops"])
+            labels.append(shard["labels"] if "labels" in shard else shard["digits"])
+    return np.concatenate(crops), np.concatenate(labels)
+
+
+def renderCrops(meterConf, frames, seed=0):
+    """Crops of generated frames with random meter values, the label is the rendered digit"""
+    from bench_replay import DigitStripRenderer
+
+    renderer = DigitStripRenderer(meterConf)
+    cropper = DigitCropper()
+    digMasks = meterConf["imgMaskDesc"]["digMasks"]
+    rng = np.random.default_rng(seed)
+
+    crops, labels = [], []
+    for idx in rng.integers(0, 10**len(digMasks), frames):
+        value = renderer.startVal + int(idx)
+        crops.append(cropper.crop(renderer(int(idx)), meterConf["meterReaderDesc"]["imgRot"], digMasks))
+        labels.extend((value // 10**(int(powa) - renderer.lowPow)) % 10 for powa in digMasks.keys())
+    return np.concatenate(crops), np.array(labels)
+
+
+def benchModel(modelPath, backend, crops, labels, batch, repeat):
+    classifier = DigitClassifier(loadInterpreter(modelPath, backend))
+    inputType = np.dtype(classifier.inputDtype).name
+
+    predicted = np.concatenate([np.argmax(classifier.predict(crops[i:i+batch]), axis=1) for i in range(0, len(crops), batch)])
+
+    latency = {}
+    for size in sorted({1, batch}):
+        sample = crops[:size]
+        classifier.predict(sample)
+        times = []
+        for _ in range(repeat):
+            classifier.predict(sample)
+            times.append(classifier.lastInvokeTime)
+        latency[size] = float(np.median(times))
+
+    return {"model": os.path.basename(modelPath), "inputType": inputType, "sizeKb": os.path.getsize(modelPath) / 1024,
+            "top1": float(np.mean(predicted == labels)), "predicted": predicted,
+            "invokeMs": {str(size): t * 1000 for size, t in latency.items()}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", action="append", help="model file, repeat to compare (default the float model)")
+    parser.add_argument("--data", nargs="*", default=[], help="held-out .npz crop shards")
+    parser.add_argument("--conf", default=os.path.join(REPO_DIR, "MeterToolConf.json"), help="masks used for rendered crops")
+    parser.add_argument("--frames", type=int, default=200, help="rendered frames without --data")
+    parser.add_argument("--backend", default="auto")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    models = args.model or [os.path.join(REPO_DIR, "DigitNumberModel.tflite")]
+
+    if args.data:
+        crops, labels = loadShards(args.data)
+    else:
+        with codecs.open(args.conf, 'r', 'utf-8') as jsf:
+            crops, labels = renderCrops(json.load(jsf), args.frames)
+
+    results = [benchModel(model, args.backend, crops, labels, args.batch, args.repeat) for model in models]
+
+    print(f"{len(crops)} crops, backend {args.backend}")
+    print(f"{'model':<34}{'input':>8}{'kB':>8}{'top-1':>8}{'agree':>8}{'1 ms':>8}{f'{args.batch} ms':>8}")
+    # Agreement with the first model shows where the quantized model differs from the float one
+    reference = results[0]["predicted"]
+    for res in results:
+        res["agreement"] = float(np.mean(res.pop("predicted") == reference))
+        invoke = res["invokeMs"]
+        print(f"{res['model']:<34}{res['inputType']:>8}{res['sizeKb']:>8.0f}{res['top1']:>8.3f}{res['agreement']:>8.3f}"
+              f"{invoke['1']:>8.3f}{invoke[str(args.batch)]:>8.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,117 @@
+"""Redraw time per mouse move of the mask overlay of ImageManLabel.
+
+Drags a mask rectangle over 640x480 and 1920x1080 frames on Qt's offscreen
+platform. For every move the event is sent, the coalescing timer is flushed
+instead of waited for and the pending repaint is processed, so each event pays
+its full redraw. The frame based redraw ImageManLabel used before the overlay
+(copy the frame, draw, convert it to a new pixmap) is measured the same way.
+
+    python benchmarks/bench_overlay.py [--moves 300] [--json results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from copy import deepcopy
+
+# Runs without a display, e.g. in a container
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import cv2
+import numpy as np
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QMouseEvent
+from PyQt5.QtCore import Qt, QEvent, QPointF
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from ImageManLabel import ImageManLabel
+
+SIZES = ((640, 480), (1920, 1080))
+
+
+def dragPath(w, h, moves):
+    start = (int(w * 0.2), int(h * 0.3))
+    ends = np.linspace((w * 0.25, h * 0.35), (w * 0.6, h * 0.7), moves).astype(int)
+    return start, [tuple(end) for end in ends]
+
+
+def mouseEvent(eventType, pos, button=Qt.NoButton):
+    return QMouseEvent(eventType, QPointF(*pos), button, Qt.LeftButton, Qt.NoModifier)
+
+
+def benchOverlay(app, frame, moves):
+    label = ImageManLabel(lambda *args: None)
+    label.setImage(frame)
+    label.show()
+    app.processEvents()
+
+    start, ends = dragPath(frame.shape[1], frame.shape[0], moves)
+    app.sendEvent(label, mouseEvent(QEvent.MouseButtonPress, start, Qt.LeftButton))
+
+    times = []
+    for end in ends:
+        begin = time.perf_counter()
+        app.sendEvent(label, mouseEvent(QEvent.MouseMove, end))
+        label.moveTimer.stop()
+        label.drawDragRect()
+        app.processEvents()
+        times.append(time.perf_counter() - begin)
+
+    label.close()
+    return times
+
+
+def benchFrameRedraw(app, frame, moves):
+    """The redraw of a mouse move as ImageManLabel did it before the overlay"""
+    label = ImageManLabel()
+    label.setImage(frame)
+    label.show()
+    app.processEvents()
+
+    start, ends = dragPath(frame.shape[1], frame.shape[0], moves)
+
+    times = []
+    for end in ends:
+        begin = time.perf_counter()
+        currImage = deepcopy(frame)
+        cv2.rectangle(currImage, start, end, (0,255,0), 2)
+        label.setPixmap(label.convert_cv_qt(deepcopy(currImage)))
+        app.processEvents()
+        times.append(time.perf_counter() - begin)
+
+    label.close()
+    return times
+
+
+def summarize(samples):
+    arr = np.array(samples) * 1000
+    return {"meanMs": float(arr.mean()), "p95Ms": float(np.percentile(arr, 95))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--moves", type=int, default=300)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    rng = np.random.default_rng(0)
+
+    results = []
+    print(f"{'frame':<12}{'redraw':<10}{'mean ms':>10}{'p95 ms':>10}")
+    for w, h in SIZES:
+        frame = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        res = {"size": [w, h],
+               "frame": summarize(benchFrameRedraw(app, frame, args.moves)),
+               "overlay": summarize(benchOverlay(app, frame, args.moves))}
+        for name in ("frame", "overlay"):
+            print(f"{f'{w}x{h}':<12}{name:<10}{res[name]['meanMs']:>10.3f}{res[name]['p95Ms']:>10.3f}")
+        results.append(res)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
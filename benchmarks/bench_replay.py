@@ -0,0 +1,305 @@
+"""Offline replay benchmark of a full MeterReader cycle.
+
+Feeds MeterReader recorded frames, a video file or a generated digit strip,
+with an in-process MQTT stand-in and flashTime / timeBtwRounds forced to zero.
+The cycle is re-implemented from the reader's stage methods to time each of
+them, it takes a single frame per round: burst voting and the flash settle
+wait of the real round are not part of the measurement. Per-stage latencies and cycles per second are printed and appended
+to a JSON results file, together with the git commit, to compare runs.
+
+    python benchmarks/bench_replay.py [--conf MeterToolConf.json] [--frames DIR | --video FILE]
+                                      [--cycles 500] [--out bench_results.json] [--opt KEY=VALUE ...]
+"""
+import argparse
+import codecs
+import contextlib
+import copy
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from MeterReader import MeterReader
+
+STAGES = ("flash_on", "capture", "rotate_crop", "inference", "plausibility", "persistence", "archive", "history", "publish", "flash_off")
+
+
+class SyntheticCamera():
+    """Stands in for CameraGrabber, frameSource(i) provides the i-th frame of the replay.
+
+    advance() prepares the next frame outside of the timed capture stage,
+    just like the real grabber decodes in its own thread.
+    """
+    def __init__(self, frameSource):
+        self.frameSource = frameSource
+        self.reconnectCount = 0
+        self._idx = 0
+        self._frame = frameSource(0)
+
+    def advance(self):
+        self._idx += 1
+        self._frame = self.frameSource(self._idx)
+
+    def getFrame(self, newerThan=None, timeout=5.0):
+        return self._frame, 0.0
+
+    def hasFrame(self, newerThan=None):
+        return True
+
+    def frameAge(self):
+        return 0.0
+
+    def stop(self):
+        pass
+
+
+class FakeMqttHandler():
+    """In-process MQTT stand-in, published messages are only counted"""
+    def __init__(self):
+        self.client = None
+        self.outbox = None
+        self.subscribeDict = {}
+        self.published = 0
+        self.disconnectCount = 0
+        self.reconnectCount = 0
+
+    def subscribeTotopic(self, topic, callback=None, decode=None, withTopic=False):
+        self.subscribeDict[topic] = callback
+
+    def publish2opic(self, topic, msg):
+        self.published += 1
+        return True, f"Sent topic: {topic}"
+
+    def publishQueued(self, topic, msg):
+        return self.publish2opic(topic, msg)
+
+
+class StageTimer():
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[stage].append(time.perf_counter() - start)
+
+
+class TimedStateStore():
+    """Wraps the reader's state store to time persistence apart from the plausibility check"""
+    def __init__(self, store):
+        self.store = store
+        self.elapsed = 0.0
+
+    def append(self, *args):
+        start = time.perf_counter()
+        try:
+            self.store.append(*args)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+class ReplayMeterReader(MeterReader):
+    def __init__(self, meterConf, frameSource, stateDir):
+        self.replayConf = meterConf
+        self.frameSource = frameSource
+        self.stateDir = stateDir
+        super().__init__("bench_meter_reader")
+
+    def loadConf(self):
+        self.meterConf = copy.deepcopy(self.replayConf)
+        readerDesc = self.meterConf["meterReaderDesc"]
+        readerDesc["flashTime"] = 0
+        readerDesc["timeBtwRounds"] = 0
+        readerDesc["stateFile"] = os.path.join(self.stateDir, "bench.state")
+
+    def setUpCamera(self):
+        self.camera = SyntheticCamera(self.frameSource)
+
+    def setUpMqtt(self):
+        self.mqttClient = FakeMqttHandler()
+
+
+class DigitStripRenderer():
+    """Renders an increasing meter value into the configured masks, rotated like the camera sees it.
+
+    The value grows by step units of the lowest digit per frame, like an odometer.
+    """
+    def __init__(self, meterConf, step=1):
+        w, h = meterConf["cameraDesc"]["imgSize"]
+        self.size = (w, h)
+        self.digMasks = meterConf["imgMaskDesc"]["digMasks"]
+        self.step = step
+
+        self.lowPow = min(int(powa) for powa in self.digMasks.keys())
+        self.startVal = int(round(meterConf["meterReaderDesc"]["initMeterVal"] / pow(10, self.lowPow)))
+
+        # The reader rotates by imgRot, so the raw frame is rotated the other way
+        self.rotM = cv2.getRotationMatrix2D(center=(w/2, h/2), angle=-meterConf["meterReaderDesc"]["imgRot"], scale=1)
+
+    def __call__(self, idx):
+        w, h = self.size
+        frame = np.full((h, w, 3), 90, dtype=np.uint8)
+        value = self.startVal + self.step*idx
+
+        for powa, rect in self.digMasks.items():
+            (x0, y0), (x1, y1) = rect
+            digit = (value // pow(10, int(powa) - self.lowPow)) % 10
+            cv2.rectangle(frame, (x0, y0), (x1, y1), (20, 20, 20), -1)
+            scale = (y1 - y0) / 40
+            (tw, th), _ = cv2.getTextSize(str(digit), cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+            org = (x0 + ((x1 - x0) - tw) // 2, y0 + ((y1 - y0) + th) // 2)
+            cv2.putText(frame, str(digit), org, cv2.FONT_HERSHEY_SIMPLEX, scale, (235, 235, 235), 2, cv2.LINE_AA)
+
+        return cv2.warpAffine(frame, self.rotM, (w, h))
+
+
+def loadFrameSource(args, meterConf):
+    if args.frames:
+        names = sorted(n for n in os.listdir(args.frames) if n.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")))
+        frames = [cv2.imread(os.path.join(args.frames, n)) for n in names[:args.max_frames]]
+    elif args.video:
+        video = cv2.VideoCapture(args.video)
+        frames = []
+        while len(frames) < args.max_frames:
+            check, frame = video.read()
+            if not check:
+                break
+            frames.append(frame)
+        video.release()
+    else:
+        return DigitStripRenderer(meterConf, args.step)
+
+    if not frames:
+        raise SystemExit("No frames to replay.")
+    return lambda idx: frames[idx % len(frames)]
+
+
+def runReplay(reader, cycles):
+    timer = StageTimer()
+    reader.stateStore = TimedStateStore(reader.stateStore)
+
+    for _ in range(cycles):
+        reader.camera.advance()
+
+        with timer.time("flash_on"):
+            isSuccess = reader.startRound()
+
+        with timer.time("capture"):
+            frame = reader.captureFrame(None, 0)
+
+        # The mask check of inferValue is trivial, the stages are called one by one
+        with timer.time("rotate_crop"):
+            crops = reader.cropDigits(frame)
+
+        with timer.time("inference"):
+            sensor = reader.decodeDigits(crops)
+
+        persistBefore = reader.stateStore.elapsed
+        evalStart = time.perf_counter()
+        reader.evaluateValue(sensor if isSuccess else None)
+        persistTime = reader.stateStore.elapsed - persistBefore
+        timer.samples["plausibility"].append(time.perf_counter() - evalStart - persistTime)
+        timer.samples["persistence"].append(persistTime)
+
+        with timer.time("archive"):
+            reader.archiveRound(sensor)
+
+        with timer.time("history"):
+            reader.recordHistory()
+
+        with timer.time("publish"):
+            reader.publishReport()
+
+        with timer.time("flash_off"):
+            reader.switchFlashOff()
+
+    # Only the reader's own work counts, preparing the replay frames does not
+    total = sum(sum(samples) for samples in timer.samples.values())
+
+    return timer, total
+
+
+def summarize(samples):
+    arr = np.array(samples) * 1000
+    return {"meanMs": float(arr.mean()), "p50Ms": float(np.percentile(arr, 50)),
+            "p95Ms": float(np.percentile(arr, 95)), "maxMs": float(arr.max())}
+
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conf", default=os.path.join(REPO_DIR, "MeterToolConf.json"))
+    parser.add_argument("--frames", help="directory of recorded frames")
+    parser.add_argument("--video", help="recorded video file")
+    parser.add_argument("--max-frames", type=int, default=100, help="recorded frames loaded and replayed round robin")
+    parser.add_argument("--step", type=int, default=1, help="increment of the generated value per frame, in lowest digit units")
+    parser.add_argument("--cycles", type=int, default=500)
+    parser.add_argument("--out", default="bench_results.json", help="JSON file the run is appended to")
+    parser.add_argument("--opt", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a meterReaderDesc setting, the value is parsed as JSON")
+    args = parser.parse_args()
+
+    with codecs.open(args.conf, 'r', 'utf-8') as jsf:
+        meterConf = json.load(jsf)
+
+    for opt in args.opt:
+        key, value = opt.split("=", 1)
+        meterConf["meterReaderDesc"][key] = json.loads(value)
+
+    frameSource = loadFrameSource(args, meterConf)
+
+    # Paths given on the command line stay relative to the caller's directory
+    args.out = os.path.abspath(args.out)
+    # The model path in the reader is relative to the repository
+    os.chdir(REPO_DIR)
+
+    with tempfile.TemporaryDirectory() as stateDir:
+        # The reader prints every cycle, that console I/O is not what is measured here
+        with contextlib.redirect_stdout(io.StringIO()):
+            reader = ReplayMeterReader(meterConf, frameSource, stateDir)
+            timer, total = runReplay(reader, args.cycles)
+        reader.stateStore.close()
+
+    result = {
+        "commit": gitCommit(),
+        "timestamp": time.time(),
+        "cycles": args.cycles,
+        "frameShape": list(frameSource(0).shape),
+        "options": args.opt,
+        "cyclesPerSec": args.cycles / total,
+        "stages": {stage: summarize(samples) for stage, samples in timer.samples.items()},
+    }
+
+    print(f"{args.cycles} cycles, {result['cyclesPerSec']:.1f} cycles/s (commit {result['commit']})")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<14}mean {stats['meanMs']:8.3f} ms   p95 {stats['p95Ms']:8.3f} ms")
+
+    results = []
+    if os.path.exists(args.out):
+        with open(args.out) as f:
+            results = json.load(f)
+    results.append(result)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=4)
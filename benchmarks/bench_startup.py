@@ -0,0 +1,62 @@
+"""Startup cost of the available TFLite backends.
+
+Every backend is measured in a fresh interpreter process: import time, model
+load time, first invoke time and peak resident memory.
+
+    python benchmarks/bench_startup.py [--json results.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from InferenceBackend import BACKENDS
+
+_PROBE = r"""
+import json, resource, sys, time
+sys.path.insert(0, {repoDir!r})
+t0 = time.perf_counter()
+from InferenceBackend import getInterpreterClass, loadInterpreter
+from DigitClassifier import DigitClassifier
+getInterpreterClass({backend!r})
+t1 = time.perf_counter()
+classifier = DigitClassifier(loadInterpreter({modelPath!r}, {backend!r}), 8)
+t2 = time.perf_counter()
+import numpy as np
+classifier.predict(np.zeros((8, 32, 20, 3), dtype=np.uint8))
+t3 = time.perf_counter()
+print(json.dumps({{"importS": t1 - t0, "loadS": t2 - t1, "firstInvokeS": t3 - t2,
+                  "peakRssMb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def probeBackend(backend, modelPath):
+    code = _PROBE.format(repoDir=REPO_DIR, backend=backend, modelPath=modelPath)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"backend": backend, "error": proc.stderr.strip().splitlines()[-1][:100]}
+    return {"backend": backend, **json.loads(proc.stdout.strip().splitlines()[-1])}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=os.path.join(REPO_DIR, "DigitNumberModel.tflite"))
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = [probeBackend(backend, args.model) for backend in [*BACKENDS.keys(), "auto"]]
+
+    print(f"{'backend':<16}{'import s':>10}{'load s':>10}{'invoke s':>10}{'peak MB':>10}")
+    for res in results:
+        if "error" in res:
+            print(f"{res['backend']:<16}  not available: {res['error']}")
+        else:
+            print(f"{res['backend']:<16}{res['importS']:>10.3f}{res['loadS']:>10.3f}{res['firstInvokeS']:>10.3f}{res['peakRssMb']:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
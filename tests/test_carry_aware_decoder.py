@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from CarryAwareDecoder import CarryAwareDecoder
+
+KEYS = ["4", "3", "2", "1", "0", "-1", "-2", "-3"]
+
+
+def oneHot(digit):
+    row = np.zeros(11, dtype=np.float32)
+    row[digit] = 1.0
+    return row
+
+
+def wheelDigits(units):
+    """Digit per key of a value given in lowest digit units"""
+    return {key: (units // 10**(int(key) + 3)) % 10 for key in KEYS}
+
+
+def readRound(decoder, units):
+    """One accepted round like MeterReader.classifyCrops, returns the decoded value in lowest digit units"""
+    truth = wheelDigits(units)
+    outputData = decoder.plan(KEYS)
+    classified = [row is None for row in outputData]
+
+    todo = [i for i, row in enumerate(outputData) if row is None]
+    while todo:
+        for i in todo:
+            outputData[i] = oneHot(truth[KEYS[i]])
+        todo = decoder.missedCarries(KEYS, outputData, classified)
+        for i in todo:
+            classified[i] = True
+
+    decoder.setRound(KEYS, outputData, classified)
+    decoder.commit()
+    return sum(int(np.argmax(row)) * 10**(int(key) + 3) for key, row in zip(KEYS, outputData))
+
+
+def test_jump_of_several_lowest_steps_per_round():
+    # 13 units of 0.001 per round: the lowest wheel turns more than a revolution
+    decoder = CarryAwareDecoder(fullRefreshRounds=30, stepThresh=0.25)
+    units = 8204664
+    for _ in range(100):
+        units += 13
+        assert readRound(decoder, units) == units
+
+
+def test_recent_delta_widens_the_classified_wheels():
+    # The step threshold alone would trust the carry rule for the wheel of 0.01
+    decoder = CarryAwareDecoder(fullRefreshRounds=1000, stepThresh=0.001)
+    units = 8204664
+    readRound(decoder, units)
+    for _ in range(50):
+        units += 37
+        assert readRound(decoder, units) == units
+
+
+def test_higher_wheels_are_skipped():
+    decoder = CarryAwareDecoder(fullRefreshRounds=30, stepThresh=0.25)
+    units = 8204664
+    for _ in range(10):
+        units += 1
+        readRound(decoder, units)
+    assert decoder.saved > 0
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DigitClassifier import voteFrames
+
+
+def frame(*digits):
+    """Probability rows of one frame from (digit, probability) pairs, the rest spread evenly"""
+    rows = []
+    for digit, prob in digits:
+        row = np.full(11, (1 - prob) / 10, dtype=np.float32)
+        row[digit] = prob
+        rows.append(row)
+    return np.array(rows)
+
+
+def reading(rows):
+    return np.argmax(rows, axis=1).tolist()
+
+
+def test_single_frame():
+    predData = np.array([frame((0, 0.9), (9, 0.8))])
+    rows, agreement = voteFrames(predData)
+
+    assert reading(rows) == [0, 9]
+    assert agreement == 1.0
+
+
+def test_unanimous_frames_are_averaged():
+    predData = np.array([frame((0, 0.9), (9, 0.8)), frame((0, 0.7), (9, 1.0))])
+    rows, agreement = voteFrames(predData)
+
+    assert reading(rows) == [0, 9]
+    assert np.allclose(rows[:, [0, 9]].diagonal(), [0.8, 0.9])
+    assert agreement == 1.0
+
+
+def test_carry_does_not_mix_frames():
+    # Digit by digit the tens would go to 1 and the ones to 9, ..19 was never shown
+    predData = np.array([frame((0, 0.3), (9, 0.95)), frame((1, 0.9), (0, 0.4))])
+    rows, agreement = voteFrames(predData)
+
+    assert reading(rows) == [1, 0]
+    assert agreement == 0.5
+
+
+def test_majority_reading_wins():
+    predData = np.array([frame((0, 0.9), (9, 0.9)), frame((1, 0.8), (0, 0.7)), frame((1, 0.7), (0, 0.8))])
+    rows, agreement = voteFrames(predData)
+
+    assert reading(rows) == [1, 0]
+    assert np.isclose(agreement, 2/3)
@@ -0,0 +1,86 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MeterStateStore import MeterStateStore
+
+RECORD = MeterStateStore._record.size
+
+
+def writeStates(path, values, **kwargs):
+    store = MeterStateStore(path, **kwargs)
+    store.load()
+    for i, value in enumerate(values):
+        store.append(value, 0.01 * i, 8204.664)
+    store.close()
+
+
+def test_roundtrip(tmp_path):
+    path = str(tmp_path / "gas.state")
+    writeStates(path, [8204.7, 8204.71, 8204.72])
+
+    assert MeterStateStore(path).load()[1:] == (8204.72, 0.02, 8204.664)
+    assert os.path.getsize(path) == 3 * RECORD
+
+
+def test_missing_file(tmp_path):
+    assert MeterStateStore(str(tmp_path / "gas.state")).load() is None
+
+
+def test_torn_tail_recovers_last_complete_state(tmp_path):
+    path = str(tmp_path / "gas.state")
+    writeStates(path, [8204.7, 8204.71, 8204.72])
+
+    # A crash in the middle of writing the third record
+    with open(path, 'r+b') as f:
+        f.truncate(2 * RECORD + RECORD // 2)
+
+    store = MeterStateStore(path)
+    assert store.load()[1:] == (8204.71, 0.01, 8204.664)
+    # The journal was compacted, new records are aligned again
+    assert os.path.getsize(path) == RECORD
+
+    store.append(8204.73, 0.02, 8204.664)
+    store.close()
+    assert MeterStateStore(path).load()[1:] == (8204.73, 0.02, 8204.664)
+
+
+def test_corrupt_record_is_skipped(tmp_path):
+    path = str(tmp_path / "gas.state")
+    writeStates(path, [8204.7, 8204.71])
+
+    with open(path, 'r+b') as f:
+        f.seek(RECORD + 3)
+        f.write(b"\xff")
+
+    assert MeterStateStore(path).load()[1:] == (8204.7, 0.0, 8204.664)
+
+
+def test_only_garbage_is_dropped(tmp_path):
+    path = str(tmp_path / "gas.state")
+    with open(path, 'wb') as f:
+        f.write(b"\x00" * (RECORD + 5))
+
+    assert MeterStateStore(path).load() is None
+    assert os.path.getsize(path) == 0
+
+
+def test_compaction_keeps_last_state(tmp_path):
+    path = str(tmp_path / "gas.state")
+    writeStates(path, [8204.7 + 0.01*i for i in range(10)], maxRecords=4)
+
+    assert os.path.getsize(path) <= 4 * RECORD
+    assert MeterStateStore(path).load()[1] == 8204.7 + 0.01*9
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_unchanged_state_is_not_appended(tmp_path):
+    path = str(tmp_path / "gas.state")
+    writeStates(path, [8204.7])
+    store = MeterStateStore(path)
+    store.load()
+    store.append(8204.7, 0.0, 8204.664)
+    store.close()
+
+    assert os.path.getsize(path) == RECORD
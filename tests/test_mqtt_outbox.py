@@ -0,0 +1,80 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MqttHandler import MqttOutbox
+
+
+def topics(outbox):
+    return [(topic, payload) for _, topic, payload, _ in outbox.peek(100)]
+
+
+def test_drop_oldest_at_capacity():
+    outbox = MqttOutbox(maxSize=3, policy="dropOldest")
+    for i in range(5):
+        assert outbox.put("meter/report", str(i))
+
+    assert topics(outbox) == [("meter/report", "2"), ("meter/report", "3"), ("meter/report", "4")]
+    assert outbox.depth() == 3
+    assert outbox.dropped == 2
+
+
+def test_drop_newest_at_capacity():
+    outbox = MqttOutbox(maxSize=3, policy="dropNewest")
+    res = [outbox.put("meter/report", str(i)) for i in range(5)]
+
+    assert res == [True, True, True, False, False]
+    assert topics(outbox) == [("meter/report", "0"), ("meter/report", "1"), ("meter/report", "2")]
+    assert outbox.dropped == 2
+
+
+def test_coalesce_keeps_newest_per_topic():
+    outbox = MqttOutbox(maxSize=3, policy="coalesce")
+    outbox.put("a", "1")
+    outbox.put("b", "1")
+    outbox.put("a", "2")
+    assert topics(outbox) == [("b", "1"), ("a", "2")]
+
+    # Full with distinct topics, the oldest one goes
+    outbox.put("c", "1")
+    outbox.put("d", "1")
+    assert topics(outbox) == [("a", "2"), ("c", "1"), ("d", "1")]
+    assert outbox.depth() == 3
+    assert outbox.dropped == 1
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        MqttOutbox(policy="dropAll")
+
+
+def test_remove_acknowledged():
+    outbox = MqttOutbox()
+    for i in range(3):
+        outbox.put("meter/report", str(i))
+    ids = [row[0] for row in outbox.peek(2)]
+    outbox.remove(ids)
+
+    assert topics(outbox) == [("meter/report", "2")]
+    assert outbox.depth() == 1
+
+
+def test_file_outbox_survives_reopen(tmp_path):
+    path = str(tmp_path / "meter.outbox")
+    outbox = MqttOutbox(path, maxSize=10)
+    for i in range(3):
+        outbox.put("meter/report", str(i), qos=1)
+    outbox.remove([outbox.peek(1)[0][0]])
+    outbox.close()
+
+    reopened = MqttOutbox(path, maxSize=10)
+    assert reopened.depth() == 2
+    assert [(topic, payload, qos) for _, topic, payload, qos in reopened.peek(10)] == [("meter/report", "1", 1), ("meter/report", "2", 1)]
+
+    # New messages queue behind the recovered ones
+    reopened.put("meter/report", "3")
+    assert [payload for _, _, payload, _ in reopened.peek(10)] == ["1", "2", "3"]
+    reopened.close()
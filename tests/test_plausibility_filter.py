@@ -0,0 +1,79 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PlausibilityFilter import PlausibilityFilter
+
+STEP = 60.0
+
+
+def steadyFilter(rounds=10, value=100.0, flow=0.01):
+    """Filter with a history of rounds readings, one every STEP seconds; returns it, the next time and value"""
+    plau = PlausibilityFilter(0.25, window=16, recoverAfter=3)
+    ts = 0.0
+    for _ in range(rounds):
+        assert plau.check(ts, value)[0]
+        ts += STEP
+        value = round(value + flow, 3)
+    return plau, ts, value
+
+
+def feed(plau, ts, values):
+    res = []
+    for value in values:
+        res.append(plau.check(ts, value)[0])
+        ts += STEP
+    return res, ts
+
+
+def test_genuine_jump_is_recovered():
+    plau, ts, _ = steadyFilter()
+
+    res, ts = feed(plau, ts, [150.0, 150.01, 150.02, 150.03])
+
+    assert res == [False, False, True, True]
+    assert plau.last()[1] == 150.03
+
+
+def test_single_outlier_is_rejected():
+    plau, ts, value = steadyFilter()
+
+    res, ts = feed(plau, ts, [value, 500.0, value + 0.01, value + 0.02])
+
+    assert res == [True, False, True, True]
+    assert plau.last()[1] == value + 0.02
+
+
+def test_low_reading_below_median_is_not_recovered():
+    plau, ts, _ = steadyFilter()
+
+    res, ts = feed(plau, ts, [90.0, 90.01, 90.02, 90.03])
+
+    assert not any(res)
+
+
+def test_wrong_plateau_recovery_is_undone():
+    plau, ts, value = steadyFilter()
+
+    # e.g. glare or a wheel read one too high, consistent enough to be recovered
+    res, ts = feed(plau, ts, [110.0, 110.0, 110.0])
+    assert res == [False, False, True]
+
+    # The correct readings are below the plateau but match the history before it
+    correct = [round(value + 0.01*i, 3) for i in range(5)]
+    res, ts = feed(plau, ts, correct)
+
+    assert res == [False, False, True, True, True]
+    assert plau.last()[1] == correct[-1]
+    assert plau.median() < 101.0
+
+
+def test_confirmed_recovery_is_kept():
+    plau, ts, _ = steadyFilter()
+    res, ts = feed(plau, ts, [150.0 + 0.01*i for i in range(20)])
+    assert res[2:] == [True] * 18
+
+    # The history before the jump is gone once the window is refilled
+    res, ts = feed(plau, ts, [100.5, 100.51, 100.52])
+    assert not any(res)
@@ -0,0 +1,103 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ReadingHistory import ReadingHistory
+
+START = 1800000000.0
+STEP = 25.0
+
+
+def readings(count, first=0):
+    """(ts, value, health) every STEP seconds, one unhealthy reading in every 7"""
+    return [(START + STEP*i, round(8204.0 + 0.01*i + 0.001*(i % 3), 3), 4 if i % 7 == 3 else 0)
+            for i in range(first, first + count)]
+
+
+def expectedRollup(rows, resolution):
+    buckets = {}
+    prev = None
+    for ts, value, health in rows:
+        delta = value - prev if prev is not None else 0.0
+        prev = value
+        bucket = ts - ts % resolution
+        rec = buckets.setdefault(bucket, {"count": 0, "health": 0, "min": value, "max": value, "first": value, "delta": 0.0})
+        rec["count"] += 1
+        rec["health"] |= health
+        rec["min"] = min(rec["min"], value)
+        rec["max"] = max(rec["max"], value)
+        rec["last"] = value
+        rec["delta"] += delta
+    return buckets
+
+
+def checkHistory(history, rows):
+    raw = history.query(0, START * 2, resolution=0)
+    assert raw["ts"] == [row[0] for row in rows]
+    assert raw["value"] == [row[1] for row in rows]
+    assert raw["health"] == [row[2] for row in rows]
+
+    for resolution in ReadingHistory.RESOLUTIONS:
+        expected = expectedRollup(rows, resolution)
+        res = history.query(0, START * 2, resolution=resolution)
+        assert res["ts"] == sorted(expected)
+        for i, bucket in enumerate(res["ts"]):
+            for name in ("count", "health", "min", "max", "first", "last"):
+                assert res[name][i] == expected[bucket][name]
+            assert res["delta"][i] == pytest.approx(expected[bucket]["delta"])
+
+
+def test_appends_across_segments(tmp_path):
+    history = ReadingHistory(str(tmp_path), segmentRecords=8)
+    rows = readings(30)
+    for row in rows:
+        history.append(*row)
+
+    assert len(history.raw.segments) == 4
+    assert len(history.raw) == 30
+    checkHistory(history, rows)
+
+    # A range starting and ending inside different segments
+    part = history.query(START + STEP*5, START + STEP*20, resolution=0)
+    assert part["ts"] == [row[0] for row in rows[5:20]]
+
+
+def test_reopen_continues_segments_and_open_buckets(tmp_path):
+    history = ReadingHistory(str(tmp_path), segmentRecords=8)
+    rows = readings(13)
+    for row in rows:
+        history.append(*row)
+    history.flush()
+    del history
+
+    history = ReadingHistory(str(tmp_path), segmentRecords=8)
+    more = readings(12, first=13)
+    for row in more:
+        history.append(*row)
+
+    assert len(history.raw.segments) == 4
+    checkHistory(history, rows + more)
+
+
+def test_clock_step_back_is_not_recorded(tmp_path):
+    history = ReadingHistory(str(tmp_path), segmentRecords=8)
+    rows = readings(3)
+    for row in rows:
+        history.append(*row)
+    history.append(START, 9999.0)
+
+    checkHistory(history, rows)
+
+
+def test_resolution_follows_max_points(tmp_path):
+    history = ReadingHistory(str(tmp_path), segmentRecords=8)
+    for row in readings(30):
+        history.append(*row)
+
+    assert history.query(0, START * 2, maxPoints=100)["resolution"] == 0
+    assert history.query(0, START * 2, maxPoints=20)["resolution"] == 60
+    with pytest.raises(ValueError):
+        history.query(0, START * 2, resolution=7)
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from InferenceBackend import loadInterpreter
+from DigitClassifier import DigitClassifier
+from RoiDetector import detectMasks
+
+DIGITS = "08204664"
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    try:
+        interpreter = loadInterpreter(os.path.join(REPO_DIR, "DigitNumberModel.tflite"))
+    except ImportError as e:
+        pytest.skip(str(e))
+    return DigitClassifier(interpreter)
+
+
+def renderMeter(imgRot, size=(640, 480)):
+    """Level row of equally sized digit wheels, rotated so that imgRot levels it again"""
+    w, h = size
+    frame = np.full((h, w, 3), 90, dtype=np.uint8)
+    for i, digit in enumerate(DIGITS):
+        x0, y0 = 60 + 52*i, 320
+        cv2.rectangle(frame, (x0, y0), (x0 + 40, y0 + 60), (20, 20, 20), -1)
+        (tw, th), _ = cv2.getTextSize(digit, cv2.FONT_HERSHEY_SIMPLEX, 1.5, 2)
+        cv2.putText(frame, digit, (x0 + (40 - tw)//2, y0 + (60 + th)//2), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (235, 235, 235), 2, cv2.LINE_AA)
+
+    rotM = cv2.getRotationMatrix2D(center=(w/2, h/2), angle=-imgRot, scale=1)
+    return cv2.warpAffine(frame, rotM, (w, h))
+
+
+@pytest.mark.parametrize("imgRot", [-6.0, -1.0, 0.0, 3.0, 7.0])
+def test_recovers_rotation(classifier, imgRot):
+    res = detectMasks(renderMeter(imgRot), [5, 3], classifier)
+
+    assert abs(res["imgRot"] - imgRot) <= 0.2
+    assert "".join(str(digit) for digit in res["digits"]) == DIGITS
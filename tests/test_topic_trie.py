@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MqttHandler import TopicTrie
+
+MATCHES = [
+    # filter, topic, matches
+    ("gas/meter/report", "gas/meter/report", True),
+    ("gas/meter/report", "gas/meter", False),
+    ("gas/meter/report", "gas/meter/report/x", False),
+    ("gas/+/report", "gas/meter/report", True),
+    ("gas/+/report", "gas/meter/other", False),
+    ("gas/+/report", "gas/report", False),
+    ("gas/+", "gas/", True),
+    ("+/+", "gas/meter", True),
+    ("+", "gas/meter", False),
+    ("gas/#", "gas/meter/report", True),
+    ("gas/#", "gas/meter", True),
+    ("gas/#", "gas", True),
+    ("gas/#", "water/meter", False),
+    ("gas/+/#", "gas/meter", True),
+    ("gas/+/#", "gas/meter/report/x", True),
+    ("#", "gas/meter", True),
+    ("#", "$SYS/broker/uptime", False),
+    ("+/broker/uptime", "$SYS/broker/uptime", False),
+    ("$SYS/#", "$SYS/broker/uptime", True),
+    ("$SYS/+/uptime", "$SYS/broker/uptime", True),
+]
+
+
+@pytest.mark.parametrize("topicFilter, topic, matches", MATCHES)
+def test_match(topicFilter, topic, matches):
+    trie = TopicTrie()
+    trie.add(topicFilter, topicFilter)
+
+    assert trie.match(topic) == ([topicFilter] if matches else [])
+
+
+def test_every_matching_filter_is_returned():
+    trie = TopicTrie()
+    for topicFilter in ("gas/meter/report", "gas/+/report", "gas/#", "#", "water/#"):
+        trie.add(topicFilter, topicFilter)
+
+    assert sorted(trie.match("gas/meter/report")) == sorted(["gas/meter/report", "gas/+/report", "gas/#", "#"])
+
+
+def test_remove():
+    trie = TopicTrie()
+    trie.add("gas/#", "a")
+    trie.add("gas/meter", "b")
+    trie.remove("gas/#")
+    trie.remove("not/subscribed")
+
+    assert trie.match("gas/meter") == ["b"]
+    assert trie.match("gas/other") == []